@@ -12,17 +12,27 @@ from pathlib import Path
 # Load environment variables
 load_dotenv(Path(__file__).parent.parent / 'config' / '.env')
 
+# Shared with core.echo_loop; set per worker process by core.coordinator
+DATA_DIR = Path(os.environ.get('ECHOLOOP_DATA_DIR') or Path(__file__).parent.parent / 'data')
+
+MODEL_NAME = 'gemini-pro'
+
 class GeminiAgent:
-    """Gemini AI agent for processing refined suggestions."""
+    """Gemini AI agent for processing refined suggestions.
     
-    def __init__(self):
+    With a ``cache`` (core.response_cache.ResponseCache) a prompt that was
+    answered before is served from the cache instead of the API.
+    """
+    
+    def __init__(self, cache=None):
         # Configure Gemini API with the API key from environment
         api_key = os.getenv('GEMINI_API_KEY')
         if not api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
         
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = genai.GenerativeModel(MODEL_NAME)
+        self.cache = cache
         logging.info("Gemini agent initialized successfully")
     
     def process_input(self, input_text: str) -> str:
@@ -40,8 +50,15 @@ Please provide:
 4. **Best practices and considerations** for the implementation.
 5. Ensure the output is well-structured and directly addresses the problem/task from the refined suggestions."""
             
+            if self.cache is not None:
+                cached = self.cache.get('gemini', MODEL_NAME, prompt)
+                if cached is not None:
+                    return cached
+            
             # Generate response from Gemini
             response = self.model.generate_content(prompt)
+            if self.cache is not None:
+                self.cache.put('gemini', MODEL_NAME, prompt, response.text)
             return response.text
             
         except Exception as e:
@@ -49,18 +66,19 @@ Please provide:
             logging.error(error_msg)
             return f"{error_msg}\nFalling back to a basic implementation outline."
 
-def run_gemini_agent():
+def run_gemini_agent(cache=None):
     """
     Main function to run the Gemini agent.
     Reads input from ai_2_out.txt, processes it through Gemini,
     and generates the final implementation to ai_3_out.txt.
+    Prompts answered before are served from ``cache`` if given.
     """
     try:
         # Initialize agent
-        agent = GeminiAgent()
+        agent = GeminiAgent(cache=cache)
         
         # 1. Read input from chatgpt_agent's output (ai_2_out.txt)
-        input_file = Path(__file__).parent.parent / 'data' / 'ai_2_out.txt'
+        input_file = DATA_DIR / 'ai_2_out.txt'
         
         try:
             with open(input_file, "r", encoding="utf-8") as f:
@@ -88,7 +106,7 @@ Note: This implementation was generated by the Gemini agent based on the refined
 """
         
         # 4. Write to ai_3_out.txt
-        output_file = Path(__file__).parent.parent / 'data' / 'ai_3_out.txt'
+        output_file = DATA_DIR / 'ai_3_out.txt'
         with open(output_file, "w", encoding="utf-8") as f:
             f.write(final_output)
         
@@ -13,14 +13,24 @@ from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException, WebDriverException
 import os
 
+from core.cancellation import current_token
+from core.tracing import span
+
+CHATGPT_URL = "https://chat.openai.com"
+
 class BrowserController:
-    """Controls browser interactions with ChatGPT."""
+    """Controls browser interactions with ChatGPT.
+    
+    With a ``cache`` (core.response_cache.ResponseCache), ``ask`` answers a
+    prompt it has seen before from the cache instead of the browser.
+    """
     
-    def __init__(self, headless: bool = False, timeout: int = 30):
+    def __init__(self, headless: bool = False, timeout: int = 30, cache=None):
         self.driver = None
         self.headless = headless
         self.timeout = timeout
         self.wait = None
+        self.cache = cache
         
     def initialize(self) -> tuple[bool, str]:
         """Initialize the browser driver."""
@@ -38,7 +48,7 @@ class BrowserController:
             self.wait = WebDriverWait(self.driver, self.timeout)
             
             # Navigate to ChatGPT
-            self.driver.get("https://chat.openai.com")
+            self.driver.get(CHATGPT_URL)
             logging.info("Browser initialized and navigated to ChatGPT")
             
             return True, "Browser initialized successfully"
@@ -94,8 +104,13 @@ class BrowserController:
             # Wait for response to appear
             time.sleep(2)  # Initial wait
             
+            token = current_token()  # set when running as a TaskQueue task
             start_time = time.time()
             while time.time() - start_time < max_wait:
+                if token and token.cancelled:
+                    error_msg = f"Stopped waiting for response: task {token.reason}"
+                    logging.warning(error_msg)
+                    return False, error_msg
                 try:
                     # Look for response messages
                     response_elements = self.driver.find_elements(
@@ -159,6 +174,23 @@ class BrowserController:
             logging.error(f"Error getting conversation history: {str(e)}")
             return []
     
+    def ask(self, message: str, max_wait: int = 60) -> tuple[bool, str]:
+        """Send a message and wait for the response, using the cache if there is one."""
+        if self.cache is not None:
+            cached = self.cache.get('chatgpt', CHATGPT_URL, message)
+            if cached is not None:
+                return True, cached
+        
+        with span('send_message', chars=len(message)):
+            success, status = self.send_message(message)
+        if not success:
+            return False, status
+        with span('wait_for_response'):
+            success, response = self.wait_for_response(max_wait)
+        if success and self.cache is not None:
+            self.cache.put('chatgpt', CHATGPT_URL, message, response)
+        return success, response
+    
     def close(self):
         """Close the browser."""
         try:
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for core.task_queue.TaskQueue and the root task_queue.TaskQueue
+
+Runs locally with no browser or network. Results are written as JSON and
+compared against a stored baseline so regressions show up in review:
+
+    python benchmarks/bench_task_queue.py                   # run and compare
+    python benchmarks/bench_task_queue.py --quick           # smaller sizes
+    python benchmarks/bench_task_queue.py --save-baseline   # refresh baseline
+
+Each benchmark runs three times and the median is kept. Thread scheduling
+still makes microsecond timings swing by tens of percent between runs, so
+only slowdowns beyond 50% are reported by default and p95/p99 latencies
+are only gated with --strict. The baseline is machine specific; refresh
+it when moving to different hardware.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# Add parent directory to path for imports
+sys.path.append(str(Path(__file__).parent.parent))
+
+BENCH_DIR = Path(__file__).parent
+DEFAULT_OUTPUT = BENCH_DIR / 'results.json'
+DEFAULT_BASELINE = BENCH_DIR / 'baseline.json'
+
+# Throughput-style metrics are better when higher; everything else when lower
+HIGHER_IS_BETTER = ('_per_s',)
+# Tail latencies swing too much between runs to gate on unless --strict
+NOISY = ('p95_us', 'p99_us')
+
+def percentiles(samples):
+    """p50/p95/p99 (nearest rank) of samples in seconds, reported in microseconds."""
+    values = sorted(samples)
+    def rank(pct):
+        return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+    return {f'p{pct}_us': round(rank(pct) * 1e6, 1) for pct in (50, 95, 99)}
+
+def noop():
+    return None
+
+def core_queue(**kwargs):
+    from core.task_queue import TaskQueue
+    return TaskQueue(**kwargs)
+
+def root_queue(**kwargs):
+    from task_queue import TaskQueue
+    return TaskQueue(**kwargs)
+
+def wait_for(futures, timeout=120):
+    deadline = time.monotonic() + timeout
+    for future in futures:
+        future.result(timeout=max(deadline - time.monotonic(), 0.001))
+
+# ----------------------------------------------------------------------------
+# Benchmarks. Each returns a flat dict of metrics.
+# ----------------------------------------------------------------------------
+
+def bench_enqueue_core(n):
+    """add_task / add_tasks throughput on a stopped core queue (no dispatch)."""
+    from core.task_queue import Task
+    tasks = [Task(f"t{i}", noop, priority=i % 3) for i in range(n)]
+    queue = core_queue(max_workers=1)
+    started = time.perf_counter()
+    for task in tasks:
+        queue.add_task(task, task.priority)
+    single = time.perf_counter() - started
+
+    tasks = [Task(f"t{i}", noop, priority=i % 3) for i in range(n)]
+    queue = core_queue(max_workers=1)
+    started = time.perf_counter()
+    queue.add_tasks(tasks)
+    bulk = time.perf_counter() - started
+    return {'add_task_per_s': round(n / single), 'add_tasks_per_s': round(n / bulk)}
+
+def bench_enqueue_root(n):
+    """add_task throughput on a stopped root queue."""
+    from task_queue import Task
+    tasks = [Task("t", noop) for _ in range(n)]
+    queue = root_queue(max_workers=1)
+    started = time.perf_counter()
+    for i, task in enumerate(tasks):
+        queue.add_task(task, i % 3)
+    return {'add_task_per_s': round(n / (time.perf_counter() - started))}
+
+def bench_dispatch_latency(make_queue, make_task, workers, n, priorities):
+    """Submit-to-start latency with an otherwise idle queue, one task at a time."""
+    queue = make_queue(max_workers=workers)
+    queue.start()
+    try:
+        latencies = []
+        for i in range(n):
+            started = []
+            task = make_task(i, lambda: started.append(time.perf_counter()))
+            submitted = time.perf_counter()
+            queue.submit(task, i % priorities).result(timeout=10)
+            latencies.append(started[0] - submitted)
+        return percentiles(latencies)
+    finally:
+        queue.stop()
+
+def bench_burst(make_queue, make_task, workers, n, priorities):
+    """End-to-end throughput and queueing latency for a burst of no-op tasks."""
+    queue = make_queue(max_workers=workers)
+    queue.start()
+    try:
+        starts = [0.0] * n
+        def record(i):
+            starts[i] = time.perf_counter()
+        submitted = []
+        futures = []
+        began = time.perf_counter()
+        for i in range(n):
+            submitted.append(time.perf_counter())
+            futures.append(queue.submit(make_task(i, record, (i,)), i % priorities))
+        wait_for(futures)
+        elapsed = time.perf_counter() - began
+        return {'tasks_per_s': round(n / elapsed),
+                **percentiles([start - sub for start, sub in zip(starts, submitted)])}
+    finally:
+        queue.stop()
+
+def bench_contention(make_queue, make_task, submitters, n):
+    """Submit latency while several threads enqueue against busy workers."""
+    queue = make_queue(max_workers=4)
+    queue.start()
+    try:
+        per_thread = n // submitters
+        latencies = [[] for _ in range(submitters)]
+        futures = [[] for _ in range(submitters)]
+        barrier = threading.Barrier(submitters)
+        def submitter(k):
+            barrier.wait()
+            for i in range(per_thread):
+                task = make_task(k * per_thread + i, noop)
+                began = time.perf_counter()
+                futures[k].append(queue.submit(task, 0))
+                latencies[k].append(time.perf_counter() - began)
+        threads = [threading.Thread(target=submitter, args=(k,)) for k in range(submitters)]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wait_for([f for group in futures for f in group])
+        elapsed = time.perf_counter() - began
+        return {'tasks_per_s': round(per_thread * submitters / elapsed),
+                **{f'submit_{k}': v for k, v in percentiles([x for group in latencies for x in group]).items()}}
+    finally:
+        queue.stop()
+
+def bench_retry_overhead(n):
+    """Extra wall time per retry on the core queue with zero retry delay."""
+    from core.task_queue import Task
+    def run(fail_first):
+        queue = core_queue(max_workers=4)
+        queue.start()
+        try:
+            futures = []
+            for i in range(n):
+                state = {'failed': not fail_first}
+                def func(state=state):
+                    if not state['failed']:
+                        state['failed'] = True
+                        raise RuntimeError("planned failure")
+                futures.append(queue.submit(Task(f"r{i}", func, max_retries=2, retry_delay=0, jitter=0)))
+            began = time.perf_counter()
+            wait_for(futures)
+            return time.perf_counter() - began
+        finally:
+            queue.stop()
+    # Keep the planned failures out of the output
+    previous = logging.root.manager.disable
+    logging.disable(logging.ERROR)
+    try:
+        clean = run(False)
+        retried = run(True)
+    finally:
+        logging.disable(previous)
+    return {'retry_overhead_us': round(max(retried - clean, 0) / n * 1e6, 1)}
+
+def bench_memory(n):
+    """Bytes held per queued task and per finished task, measured with tracemalloc."""
+    from core.task_queue import Task
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    queue = core_queue(max_workers=4)
+    queue.add_tasks(Task(f"m{i}", noop) for i in range(n))
+    queued = tracemalloc.get_traced_memory()[0] - base
+    queue.start()
+    while queue.get_queue_stats()['completed'] < n:
+        time.sleep(0.01)
+    queue.stop()
+    gc.collect()
+    finished = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return {'queued_bytes_per_task': round(queued / n), 'finished_bytes_per_task': round(finished / n)}
+
+def bench_dag(shape, n, workers):
+    """Completion time of a dependency graph of no-op tasks on the root queue."""
+    from task_queue import Task
+    queue = root_queue(max_workers=workers)
+    queue.start()
+    try:
+        futures = []
+        began = time.perf_counter()
+        if shape == 'chain':
+            previous = []
+            for _ in range(n):
+                task_id = queue.add_task(Task("c", noop, dependencies=previous))
+                previous = [task_id]
+                futures.append(queue.tasks[task_id].future)
+        elif shape == 'fan_out':
+            root_id = queue.add_task(Task("root", noop))
+            futures = [queue.submit(Task("leaf", noop, dependencies=[root_id])) for _ in range(n)]
+        elif shape == 'fan_in':
+            leaves = [queue.add_task(Task("leaf", noop)) for _ in range(n)]
+            futures = [queue.submit(Task("sink", noop, dependencies=leaves))]
+        elif shape == 'layered':
+            # Layers of 10 where every task depends on the whole previous layer
+            layer = []
+            for _ in range(n // 10):
+                layer = [queue.add_task(Task("l", noop, dependencies=layer)) for _ in range(10)]
+            futures = [queue.tasks[task_id].future for task_id in layer]
+        wait_for(futures)
+        elapsed = time.perf_counter() - began
+        return {'tasks_per_s': round(n / elapsed)}
+    finally:
+        queue.stop()
+
+# ----------------------------------------------------------------------------
+# Driver
+# ----------------------------------------------------------------------------
+
+def core_task(i, func, args=()):
+    from core.task_queue import Task
+    return Task(f"b{i}", func, args)
+
+def root_task(i, func, args=()):
+    from task_queue import Task
+    return Task("b", func, args)
+
+def run_suite(quick=False, repeat=3):
+    """Run every benchmark ``repeat`` times and keep the median of each metric."""
+    scale = 0.2 if quick else 1.0
+    def size(n):
+        return max(int(n * scale), 10)
+    cases = [
+        ('enqueue/core', bench_enqueue_core, (size(20000),)),
+        ('enqueue/root', bench_enqueue_root, (size(20000),))
+    ]
+    for label, make_queue, make_task in (('core', core_queue, core_task), ('root', root_queue, root_task)):
+        for workers in (1, 4, 16):
+            cases.append((f'dispatch/{label}/w{workers}', bench_dispatch_latency,
+                          (make_queue, make_task, workers, size(500), 1)))
+        for priorities in (1, 3):
+            for workers in (1, 4, 16):
+                cases.append((f'burst/{label}/w{workers}/p{priorities}', bench_burst,
+                              (make_queue, make_task, workers, size(5000), priorities)))
+        for submitters in (1, 4, 8):
+            cases.append((f'contention/{label}/s{submitters}', bench_contention,
+                          (make_queue, make_task, submitters, size(4000))))
+    cases.append(('retry/core', bench_retry_overhead, (size(1000),)))
+    cases.append(('memory/core', bench_memory, (size(10000),)))
+    for shape in ('chain', 'fan_out', 'fan_in', 'layered'):
+        cases.append((f'dag/{shape}', bench_dag, (shape, size(2000), 4)))
+    
+    results = {}
+    for name, bench, args in cases:
+        runs = [bench(*args) for _ in range(repeat)]
+        results[name] = {metric: statistics.median(run[metric] for run in runs) for metric in runs[0]}
+    return results
+
+def compare(results, baseline, tolerance, strict=False):
+    """Return (metric, baseline, current, change) rows for metrics that got worse than tolerance."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not old or (metric.endswith(NOISY) and not strict):
+                continue
+            change = (value - old) / old
+            higher_is_better = metric.endswith(HIGHER_IS_BETTER)
+            worse = -change if higher_is_better else change
+            if worse > tolerance:
+                regressions.append((f"{name}.{metric}", old, value, change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='TaskQueue micro-benchmarks')
+    parser.add_argument('--quick', action='store_true', help='run with smaller sizes')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help='where to write JSON results')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='relative slowdown reported as a regression (default 0.5)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, median is kept (default 3)')
+    parser.add_argument('--strict', action='store_true', help='also gate on p95/p99 latencies')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on regressions')
+    parser.add_argument('--with-logging', action='store_true', help='keep INFO task logging enabled')
+    args = parser.parse_args()
+
+    if not args.with_logging:
+        # Per-task INFO lines would dominate the numbers
+        logging.disable(logging.INFO)
+
+    results = run_suite(args.quick, args.repeat)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'quick': args.quick,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    width = max(len(name) for name in results)
+    for name, metrics in results.items():
+        print(f"{name:<{width}}  " + "  ".join(f"{k}={v}" for k, v in metrics.items()))
+    print(f"\nResults written to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not Path(args.baseline).exists():
+        print("No baseline to compare against (run with --save-baseline)")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['meta'].get('quick') != args.quick:
+        print("Warning: baseline was recorded with a different --quick setting")
+    regressions = compare(results, baseline['results'], args.tolerance, args.strict)
+    if not regressions:
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+        return 0
+    print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%}:")
+    for metric, old, new, change in regressions:
+        print(f"  {metric}: {old} -> {new} ({change:+.0%})")
+    return 1 if args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Append-only on-disk archive for tasks evicted from a TaskQueue
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS offsets (
+    task_id TEXT PRIMARY KEY,
+    offset INTEGER
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+class TaskArchive:
+    """Append-only JSON-lines file of finished task records.
+
+    The ``task_id -> file offset`` index lives in a SQLite file next to the
+    archive (``<path>.index``), so memory use stays flat however many tasks
+    are archived; records are read back from the archive on lookup. The
+    index records how much of the archive it covers and catches up on open,
+    so a lost or stale index is rebuilt from the archive itself.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path) + '.index', check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # The index can always be rebuilt from the archive, so it need not be synced
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.executescript(INDEX_SCHEMA)
+        self.count = 0
+        self._load_index()
+        self.count = self.conn.execute("SELECT COUNT(*) FROM offsets").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, task_id: str) -> bool:
+        return self._offset(task_id) is not None
+
+    def append(self, records: Iterable[Dict[str, Any]]):
+        """Append task records. Each record must contain a 'task_id' key."""
+        with self.lock:
+            entries = []
+            with open(self.path, 'ab') as f:
+                for record in records:
+                    offset = f.tell()
+                    line = json.dumps(record, default=str, ensure_ascii=False) + '\n'
+                    f.write(line.encode('utf-8'))
+                    entries.append((record['task_id'], offset))
+                end = f.tell()
+            self._index(entries, end)
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """Return the archived record for a task, or None if it was never archived."""
+        offset = self._offset(task_id)
+        if offset is None:
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return json.loads(f.readline().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            logging.error(f"Error reading archived task {task_id}: {str(e)}")
+            return None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _offset(self, task_id: str) -> Optional[int]:
+        with self.lock:
+            row = self.conn.execute("SELECT offset FROM offsets WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def _index(self, entries, end: int):
+        """Record offsets and how far the archive is indexed. Must be called with the lock held."""
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO offsets (task_id, offset) VALUES (?, ?)", entries)
+            self.count += self.conn.total_changes - before
+            # Later records of a re-archived id replace earlier ones, as in the file
+            self.conn.executemany("UPDATE offsets SET offset = ? WHERE task_id = ?",
+                                  [(offset, task_id) for task_id, offset in entries])
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed_bytes', ?)", (end,))
+
+    def _load_index(self):
+        """Index archive lines written since the index was last updated."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'indexed_bytes'").fetchone()
+        offset = row[0] if row else 0
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if offset > size:
+            # The archive was replaced or truncated; start over
+            self.conn.execute("DELETE FROM offsets")
+            offset = 0
+        if offset == size:
+            self.conn.commit()
+            return
+        entries = []
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # partly written last line
+                try:
+                    entries.append((json.loads(line)['task_id'], offset))
+                except (ValueError, KeyError):
+                    logging.warning(f"Skipping corrupt archive line at offset {offset} in {self.path}")
+                offset += len(line)
+        self._index(entries, offset)
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Asyncio task queue for I/O-bound EchoLoop work
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from core.scheduler import IndexedHeap
+from core.task_queue import Task
+
+# Task options that only the thread-based TaskQueue implements
+UNSUPPORTED_OPTIONS = ('timeout', 'resources', 'affinity', 'idempotency_key')
+
+class AsyncTask(Task):
+    """Task for AsyncTaskQueue.
+
+    ``func`` may be a coroutine function, or a plain callable which is run in
+    the queue's thread pool. ``dependencies`` are ids of tasks that must
+    complete before this one becomes ready. The TaskQueue-only options in
+    UNSUPPORTED_OPTIONS are rejected rather than silently ignored.
+    """
+
+    def __init__(self, task_id: str, func: Callable, args: tuple = (), kwargs: dict = None,
+                 max_retries: int = 3, retry_delay: int = 5, priority: int = 0,
+                 dependencies: List[str] = None, **options):
+        unsupported = [name for name in UNSUPPORTED_OPTIONS if options.get(name) is not None]
+        if unsupported:
+            raise ValueError(f"AsyncTaskQueue does not support the task options {unsupported}")
+        super().__init__(task_id, func, args, kwargs, max_retries, retry_delay, priority, **options)
+        if self.executor == 'process':
+            raise ValueError("AsyncTaskQueue does not support executor='process'")
+        self.dependencies = dependencies or []
+        self.indegree = 0
+
+class AsyncTaskQueue:
+    """Priority task queue running coroutines on a single event loop.
+
+    Mirrors TaskQueue: tasks are ordered by priority with FIFO tiebreak,
+    failed tasks are retried with backoff via ``loop.call_later``, and tasks
+    with dependencies only become ready once every dependency completed.
+    At most ``max_concurrency`` tasks are in flight at once; synchronous
+    callables are bridged to a ``sync_workers`` thread pool, so hundreds of
+    concurrent HTTP calls need no more threads than that.
+
+    ``add_task`` / ``cancel`` must be called from the loop thread; use
+    ``add_task_threadsafe`` from other threads.
+    """
+
+    def __init__(self, max_concurrency: int = 100, sync_workers: int = 8):
+        self.max_concurrency = max_concurrency
+        self.sync_pool = ThreadPoolExecutor(max_workers=sync_workers, thread_name_prefix="AsyncTaskSync")
+        self.ready = IndexedHeap()
+        self.tasks: Dict[str, AsyncTask] = {}
+        self.dependents: Dict[str, List[str]] = {}  # task_id -> ids of tasks waiting on it
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self.status_counts = {status: 0 for status in ('pending', 'running', 'completed', 'failed', 'cancelled')}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.idle: Optional[asyncio.Event] = None
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.running = False
+
+    async def start(self):
+        """Start dispatching on the running event loop."""
+        if self.running:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.idle = asyncio.Event()
+        self._update_idle()
+        self.running = True
+        self.dispatcher = self.loop.create_task(self._dispatch_loop())
+        logging.info(f"Started async task queue (max concurrency {self.max_concurrency})")
+
+    async def stop(self):
+        """Stop dispatching and cancel every task that has not finished."""
+        self.running = False
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            await asyncio.gather(self.dispatcher, return_exceptions=True)
+        waiting = []
+        for task_id, handle in self.retry_handles.items():
+            handle.cancel()
+            waiting.append(self.tasks[task_id])
+        self.retry_handles.clear()
+        while self.ready:
+            waiting.append(self.ready.pop()[1])
+        for task in waiting:
+            self._finish_cancelled(task)
+        in_flight = list(self.in_flight.values())
+        for aio_task in in_flight:
+            aio_task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        self.sync_pool.shutdown(wait=False)
+        logging.info("Stopped async task queue")
+
+    async def join(self):
+        """Wait until no task is pending or running."""
+        if self.idle is None:
+            raise RuntimeError("AsyncTaskQueue.join() called before start()")
+        await self.idle.wait()
+
+    def add_task(self, task: AsyncTask, priority: int = 0) -> str:
+        """Add a task. Must be called from the event loop thread."""
+        task.priority = priority
+        previous = self.tasks.get(task.task_id)
+        if previous is not None:
+            if previous.status in ('pending', 'running'):
+                raise ValueError(f"Task {task.task_id} is already queued")
+            self.status_counts[previous.status] -= 1
+        self.tasks[task.task_id] = task
+        self.status_counts[task.status] += 1
+
+        failed_dependency = None
+        for dep in task.dependencies:
+            dep_task = self.tasks.get(dep)
+            if dep_task and dep_task.status == 'completed':
+                continue
+            if dep_task and dep_task.status in ('failed', 'cancelled'):
+                failed_dependency = dep
+                break
+            task.indegree += 1
+            self.dependents.setdefault(dep, []).append(task.task_id)
+
+        logging.info(f"Added async task {task.task_id} with priority {priority}")
+        if failed_dependency is not None:
+            self._fail_dependents(failed_dependency, [task.task_id])
+        elif task.indegree == 0:
+            self._push_ready(task)
+        self._update_idle()
+        return task.task_id
+
+    async def submit(self, task: AsyncTask, priority: int = 0) -> Any:
+        """Add a task and wait for its result."""
+        self.add_task(task, priority)
+        return await asyncio.wrap_future(task.future)
+
+    def add_task_threadsafe(self, task: AsyncTask, priority: int = 0) -> Future:
+        """Add a task from another thread; returns its concurrent.futures.Future."""
+        if self.loop is None:
+            raise RuntimeError("AsyncTaskQueue.add_task_threadsafe() called before start()")
+        self.loop.call_soon_threadsafe(self.add_task, task, priority)
+        return task.future
+
+    def cancel(self, task_id: str) -> bool:
+        """Cancel a waiting, retry-pending or running task."""
+        task = self.tasks.get(task_id)
+        if task is None or task.status not in ('pending', 'running'):
+            return False
+        if task_id in self.in_flight:
+            # _run_task notices the cancellation and finishes the task
+            self.in_flight[task_id].cancel()
+            return True
+        if task_id in self.ready:
+            self.ready.remove(task_id)
+        elif task_id in self.retry_handles:
+            self.retry_handles.pop(task_id).cancel()
+        self._finish_cancelled(task)
+        return True
+
+    def get_task_status(self, task_id: str) -> Dict[str, Any]:
+        """Get the status of a task."""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return {'status': 'not_found'}
+        return {
+            'status': task.status,
+            'attempts': task.attempts,
+            'max_retries': task.max_retries,
+            'created_at': task.created_at,
+            'started_at': task.started_at,
+            'completed_at': task.completed_at,
+            'result': task.result,
+            'error': str(task.error) if task.error else None,
+            'dependencies': task.dependencies
+        }
+
+    def get_queue_stats(self) -> Dict[str, Any]:
+        """Get queue statistics."""
+        return {
+            'queue_size': len(self.ready),
+            'in_flight': len(self.in_flight),
+            'max_concurrency': self.max_concurrency,
+            **self.status_counts,
+            'total_tasks': len(self.tasks)
+        }
+
+    async def _dispatch_loop(self):
+        while self.running:
+            while self.ready and len(self.in_flight) < self.max_concurrency:
+                task_id, task = self.ready.pop()
+                if task.attempts == 0 and not task.future.set_running_or_notify_cancel():
+                    self._finish_cancelled(task)
+                    continue
+                self.in_flight[task_id] = self.loop.create_task(self._run_task(task))
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    async def _run_task(self, task: AsyncTask):
+        task.attempts += 1
+        task.started_at = datetime.now()
+        self._set_status(task, 'running')
+        logging.info(f"Executing async task {task.task_id} (attempt {task.attempts}/{task.max_retries})")
+
+        try:
+            result = await self._call(task)
+        except asyncio.CancelledError:
+            self._finish_cancelled(task)
+            return
+        except Exception as e:
+            logging.error(f"Async task {task.task_id} failed: {str(e)}")
+            task.error = e
+            if task.attempts < task.max_retries and self.running:
+                delay = task.next_retry_delay()
+                self._set_status(task, 'pending')
+                self.retry_handles[task.task_id] = self.loop.call_later(delay, self._requeue, task)
+                logging.info(f"Retrying async task {task.task_id} in {delay:.1f} seconds")
+            else:
+                self._set_status(task, 'failed')
+                task.completed_at = datetime.now()
+                task.future.set_exception(e)
+                logging.error(f"Async task {task.task_id} failed permanently after {task.attempts} attempts")
+                self._fail_dependents(task.task_id, self.dependents.pop(task.task_id, []))
+        else:
+            task.result = result
+            self._set_status(task, 'completed')
+            task.completed_at = datetime.now()
+            task.future.set_result(result)
+            logging.info(f"Async task {task.task_id} completed successfully")
+            self._release_dependents(task.task_id)
+        finally:
+            self.in_flight.pop(task.task_id, None)
+            self.wakeup.set()
+            self._update_idle()
+
+    async def _call(self, task: AsyncTask) -> Any:
+        """Await a coroutine function, or run a sync callable in the thread pool (or inline)."""
+        if inspect.iscoroutinefunction(task.func):
+            return await task.func(*task.args, **task.kwargs)
+        if task.executor == 'inline':
+            # Cheap sync callables can skip the thread pool hop
+            return task.func(*task.args, **task.kwargs)
+        call = functools.partial(task.func, *task.args, **task.kwargs)
+        result = await self.loop.run_in_executor(self.sync_pool, call)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    def _push_ready(self, task: AsyncTask):
+        self.ready.push(task.task_id, task, task.priority)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def _requeue(self, task: AsyncTask):
+        if self.retry_handles.pop(task.task_id, None) is not None:
+            self._push_ready(task)
+
+    def _set_status(self, task: AsyncTask, status: str):
+        self.status_counts[task.status] -= 1
+        self.status_counts[status] += 1
+        task.status = status
+
+    def _finish_cancelled(self, task: AsyncTask):
+        self._set_status(task, 'cancelled')
+        task.completed_at = datetime.now()
+        if not task.future.cancel() and not task.future.done():
+            task.future.set_exception(CancelledError(f"Task {task.task_id} was cancelled"))
+        logging.info(f"Cancelled async task {task.task_id}")
+        self._fail_dependents(task.task_id, self.dependents.pop(task.task_id, []))
+        self._update_idle()
+
+    def _release_dependents(self, task_id: str):
+        for tid in self.dependents.pop(task_id, []):
+            task = self.tasks[tid]
+            task.indegree -= 1
+            if task.indegree == 0 and task.status == 'pending':
+                self._push_ready(task)
+
+    def _fail_dependents(self, task_id: str, dependents: List[str]):
+        """Fail every task that transitively depends on a failed task."""
+        stack = [(task_id, tid) for tid in dependents]
+        while stack:
+            cause, tid = stack.pop()
+            task = self.tasks[tid]
+            if task.status != 'pending':
+                continue
+            task.error = RuntimeError(f"Dependency {cause} did not complete")
+            self._set_status(task, 'failed')
+            task.completed_at = datetime.now()
+            task.future.set_exception(task.error)
+            logging.error(f"Failed async task: {tid} - {task.error}")
+            stack.extend((tid, dependent) for dependent in self.dependents.pop(tid, []))
+
+    def _update_idle(self):
+        if self.idle is None:
+            return
+        if self.status_counts['pending'] or self.status_counts['running']:
+            self.idle.clear()
+        else:
+            self.idle.set()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Cooperative cancellation tokens for long-running task functions
+"""
+
+import threading
+from typing import Optional
+
+class TaskTimeoutError(Exception):
+    """Raised (or recorded) when a task attempt exceeds its deadline."""
+
+class TaskCancelledError(Exception):
+    """Raised by CancelToken.raise_if_cancelled() once the token is cancelled."""
+
+class CancelToken:
+    """Flag a running task function can poll to stop early.
+
+    The queue cancels the token when the attempt times out or the task is
+    cancelled; ``reason`` is then 'timeout' or 'cancelled'. Task functions
+    get the token of the attempt they are running via ``current_token()``.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def cancel(self, reason: str = 'cancelled'):
+        if not self.event.is_set():
+            self.reason = reason
+            self.event.set()
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise TaskCancelledError(f"Task {self.reason}")
+
+    def sleep(self, seconds: float) -> bool:
+        """Sleep up to ``seconds``; returns True if woken early by cancellation."""
+        return self.event.wait(seconds)
+
+_local = threading.local()
+
+def current_token() -> Optional[CancelToken]:
+    """Cancel token of the task attempt running on this thread, if any."""
+    return getattr(_local, 'token', None)
+
+def set_current_token(token: Optional[CancelToken]) -> Optional[CancelToken]:
+    """Install token for this thread and return the previous one."""
+    previous = getattr(_local, 'token', None)
+    _local.token = token
+    return previous
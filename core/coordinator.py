@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Coordinator that shards prompts across independent EchoLoop worker processes
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import time
+import traceback
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+PROMPT_SEPARATOR = '---'
+MAX_PROMPT_ATTEMPTS = 3  # a prompt that fails this many times is given up on
+COMMIT_EVERY = 25  # completed prompts between automated commits
+WORKER_DIRS = ('data', 'logs', 'results')  # worker bookkeeping, not output to merge
+
+def load_prompts(path) -> List[str]:
+    """Prompts from a text file, separated by lines containing only ``---``."""
+    blocks = [[]]
+    for line in Path(path).read_text(encoding='utf-8').splitlines():
+        if line.strip() == PROMPT_SEPARATOR:
+            blocks.append([])
+        else:
+            blocks[-1].append(line)
+    return [text for text in ('\n'.join(block).strip() for block in blocks) if text]
+
+def prompt_key(prompt: str) -> str:
+    """Run key of a prompt, from its text so checkpoints follow it when the prompts file changes."""
+    return f"prompt_{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]}"
+
+def _snapshot_files(workdir: Path) -> Dict[str, int]:
+    """Relative path -> mtime of every file under workdir a prompt may have produced."""
+    files = {}
+    for path in workdir.rglob('*'):
+        rel = path.relative_to(workdir)
+        if rel.parts[0] not in WORKER_DIRS and path.is_file():
+            files[rel.as_posix()] = path.stat().st_mtime_ns
+    return files
+
+def _stash_outputs(workdir: Path, prompt_id: str, before: Dict[str, int]) -> List[str]:
+    """Copy what a prompt changed to results/<prompt_id>, where the next prompt cannot overwrite it."""
+    stash = workdir / 'results' / prompt_id
+    changed = [rel for rel, mtime in _snapshot_files(workdir).items() if before.get(rel) != mtime]
+    for rel in changed:
+        dest = stash / 'files' / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(workdir / rel, dest)
+    stash.mkdir(parents=True, exist_ok=True)
+    for name in ('ai_2_out.txt', 'ai_3_out.txt'):
+        if (workdir / 'data' / name).exists():
+            shutil.copy2(workdir / 'data' / name, stash / name)
+    return changed
+
+def worker_main(index: int, workdir: str, prompts, results, workers: int, headless: bool):
+    """Worker process: its own browser, task queue, journal, cache and files under workdir.
+
+    Takes (prompt_id, prompt) pairs from ``prompts`` until it gets None,
+    runs each as one iteration and reports to ``results``.
+    """
+    workdir = Path(workdir)
+    (workdir / 'data').mkdir(parents=True, exist_ok=True)
+    (workdir / 'logs').mkdir(exist_ok=True)
+    os.environ['ECHOLOOP_DATA_DIR'] = str(workdir / 'data')
+    os.environ['ECHOLOOP_OUTPUT_DIR'] = str(workdir)
+    sys.path.append(str(ROOT))
+    logging.basicConfig(filename=str(workdir / 'logs' / 'loop.log'), level=logging.INFO,
+                        format=f'%(asctime)s - worker {index} - %(levelname)s - %(message)s')
+
+    # Imported only now so they pick up this worker's data and output directories
+    from automation.browser_controller import BrowserController
+    from core.echo_loop import RESOURCE_LIMITS, build_iteration_graph
+    from core.journal import TaskJournal
+    from core.response_cache import ResponseCache
+    from core.task_queue import TaskQueue
+
+    limits = {name: dict(options) for name, options in RESOURCE_LIMITS.items()}
+    if limits['gemini'].get('rate'):
+        limits['gemini']['rate'] /= workers  # the Gemini quota is per account, not per process
+    journal = TaskJournal(workdir / 'logs' / 'task_journal.db')
+    for row in journal.unfinished():
+        journal.mark_abandoned(row['task_id'])
+    task_queue = TaskQueue(min_workers=1, max_workers=4, max_finished_tasks=500, journal=journal,
+                           resources=limits)
+    task_queue.start()
+    cache = ResponseCache(workdir / 'logs' / 'response_cache.db')
+    browser = BrowserController(headless=headless, cache=cache)
+    try:
+        success, message = browser.initialize()
+        if not success:
+            results.put({'worker': index, 'event': 'error', 'error': message})
+            return
+        # Workers share the desktop, so they do not capture the screen or type
+        graph = build_iteration_graph(browser, cache, typing=False)
+        results.put({'worker': index, 'event': 'ready', 'pid': os.getpid()})
+
+        while True:
+            entry = prompts.get()
+            if entry is None:
+                break
+            prompt_id, prompt = entry
+            results.put({'worker': index, 'event': 'started', 'prompt_id': prompt_id})
+            (workdir / 'data' / 'ai_1_out.txt').write_text(prompt, encoding='utf-8')
+            before = _snapshot_files(workdir)
+            try:
+                run = graph.run(task_queue, prompt_key(prompt), prompt_id, priority=1).result()
+                files = _stash_outputs(workdir, prompt_id, before)
+            except Exception as e:
+                results.put({'worker': index, 'event': 'failed', 'prompt_id': prompt_id, 'error': str(e)})
+                continue
+            results.put({'worker': index, 'event': 'completed', 'prompt_id': prompt_id,
+                         'summary': run.summary(), 'files': files, 'cache': cache.stats()})
+    except Exception as e:
+        logging.error(f"Worker {index} crashed: {str(e)}\n{traceback.format_exc()}")
+        results.put({'worker': index, 'event': 'error', 'error': str(e)})
+    finally:
+        task_queue.stop()
+        journal.close()
+        browser.close()
+        cache.close()
+        results.put({'worker': index, 'event': 'stopped'})
+
+class Coordinator:
+    """Runs prompts across ``workers`` EchoLoop worker processes.
+
+    Each worker drives its own browser session and conversation from its own
+    directory under ``work_root``, so N workers make N iterations at once.
+    Prompts are handed out from a shared queue as workers free up; a prompt
+    whose iteration fails is queued again, up to MAX_PROMPT_ATTEMPTS, and
+    the prompt of a worker that dies is queued again right away.
+
+    Files a prompt produced are merged into ``output_root`` (the project
+    tree), and its ChatGPT and Gemini outputs are kept under
+    ``data/results/<prompt_id>``. When two prompts write the same file the
+    later one wins and a warning is logged. Per-worker status and totals are
+    written to ``logs/coordinator_status.json`` after every change, and
+    the merged tree is committed and pushed every COMMIT_EVERY prompts;
+    workers never commit.
+    """
+
+    def __init__(self, prompts: List[str], workers: int = 2, work_root=None, output_root=None,
+                 headless: bool = False):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.prompts = {f"{number:04d}": prompt for number, prompt in enumerate(prompts)}
+        self.workers = workers
+        self.work_root = Path(work_root or ROOT / 'work')
+        self.output_root = Path(output_root or ROOT).resolve()
+        self.status_file = ROOT / 'logs' / 'coordinator_status.json'
+        self.headless = headless
+        self.attempts = {prompt_id: 0 for prompt_id in self.prompts}
+        self.pending = set(self.prompts)  # neither completed nor given up on
+        self.completed: List[str] = []
+        self.failed: List[str] = []
+        self.merged: Dict[str, tuple] = {}  # relative path -> (worker, prompt_id) it came from
+        self.status: Dict[int, Dict[str, Any]] = {}
+        self.repo = None
+
+    def run(self) -> Dict[str, Any]:
+        """Process every prompt, then stop the workers. Returns the final status."""
+        logging.basicConfig(filename=str(ROOT / 'logs' / 'coordinator.log'), level=logging.INFO,
+                            format='%(asctime)s - coordinator - %(levelname)s - %(message)s')
+        context = multiprocessing.get_context('spawn')  # fresh interpreters; WebDriver does not survive fork
+        self.prompt_queue = context.Queue()
+        self.results = context.Queue()
+        for prompt_id, prompt in self.prompts.items():
+            self.prompt_queue.put((prompt_id, prompt))
+
+        processes = {}
+        for index in range(self.workers):
+            workdir = self.work_root / f"worker_{index}"
+            process = context.Process(target=worker_main, name=f"EchoLoopWorker-{index}",
+                                      args=(index, str(workdir), self.prompt_queue, self.results,
+                                            self.workers, self.headless))
+            process.start()
+            processes[index] = process
+            self.status[index] = {'state': 'starting', 'pid': process.pid, 'workdir': str(workdir),
+                                  'prompt_id': None, 'completed': 0, 'failed': 0}
+        logging.info(f"Coordinator started {self.workers} workers for {len(self.prompts)} prompts")
+        self._write_status()
+
+        try:
+            while self.pending and any(process.is_alive() for process in processes.values()):
+                try:
+                    message = self.results.get(timeout=1)
+                except queue.Empty:
+                    self._check_workers(processes)
+                    continue
+                self._handle(message)
+                self._write_status()
+        except KeyboardInterrupt:
+            logging.info("Coordinator interrupted, stopping workers...")
+        finally:
+            for _ in processes:
+                self.prompt_queue.put(None)
+            deadline = time.monotonic() + 30
+            for process in processes.values():
+                process.join(timeout=max(deadline - time.monotonic(), 0))
+                if process.is_alive():
+                    process.terminate()
+            self._drain()
+            self._write_status()
+
+        if self.pending:
+            logging.error(f"Coordinator finished with {len(self.pending)} prompts unprocessed: {sorted(self.pending)}")
+        logging.info(f"Coordinator done: {len(self.completed)} completed, {len(self.failed)} failed")
+        return self.get_status()
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            'updated_at': datetime.now().isoformat(),
+            'prompts': len(self.prompts),
+            'completed': len(self.completed),
+            'failed': sorted(self.failed),
+            'pending': len(self.pending),
+            'merged_files': len(self.merged),
+            'workers': {str(index): dict(status) for index, status in self.status.items()}
+        }
+
+    def _handle(self, message: Dict[str, Any]):
+        status = self.status[message['worker']]
+        event = message['event']
+        if event == 'ready':
+            status.update(state='idle', pid=message['pid'])
+        elif event == 'started':
+            status.update(state='busy', prompt_id=message['prompt_id'])
+            self.attempts[message['prompt_id']] += 1
+        elif event == 'completed':
+            prompt_id = message['prompt_id']
+            status.update(state='idle', prompt_id=None, last_summary=message['summary'], cache=message['cache'])
+            status['completed'] += 1
+            if prompt_id in self.pending:
+                self.pending.discard(prompt_id)
+                self.completed.append(prompt_id)
+                self._merge(message['worker'], prompt_id, message['files'])
+                logging.info(f"Worker {message['worker']} completed prompt {prompt_id}: {message['summary']}")
+                if len(self.completed) % COMMIT_EVERY == 0:
+                    self._commit()
+        elif event == 'failed':
+            status.update(state='idle', prompt_id=None, last_error=message['error'])
+            status['failed'] += 1
+            self._retry(message['prompt_id'], message['error'])
+        elif event == 'error':
+            prompt_id = status['prompt_id']
+            status.update(state='error', prompt_id=None, last_error=message['error'])
+            logging.error(f"Worker {message['worker']} error: {message['error']}")
+            if prompt_id is not None:
+                self._retry(prompt_id, message['error'])
+        elif event == 'stopped':
+            status['state'] = 'stopped'
+
+    def _retry(self, prompt_id: str, error: str):
+        """Queue a prompt again, or give up on it after MAX_PROMPT_ATTEMPTS."""
+        if prompt_id not in self.pending:
+            return
+        if self.attempts[prompt_id] >= MAX_PROMPT_ATTEMPTS:
+            self.pending.discard(prompt_id)
+            self.failed.append(prompt_id)
+            logging.error(f"Giving up on prompt {prompt_id} after {self.attempts[prompt_id]} attempts: {error}")
+            return
+        logging.warning(f"Prompt {prompt_id} failed ({error}); queueing it again")
+        self.prompt_queue.put((prompt_id, self.prompts[prompt_id]))
+
+    def _check_workers(self, processes: Dict[int, multiprocessing.Process]):
+        """Requeue the prompt of any worker that died without reporting."""
+        for index, process in processes.items():
+            status = self.status[index]
+            if process.is_alive() or status['state'] in ('dead', 'stopped', 'error'):
+                continue
+            prompt_id = status['prompt_id']
+            status.update(state='dead', prompt_id=None, exitcode=process.exitcode)
+            logging.error(f"Worker {index} exited with code {process.exitcode}")
+            if prompt_id is not None:
+                self._retry(prompt_id, f"worker {index} died")
+            self._write_status()
+
+    def _drain(self):
+        """Handle the messages workers sent while shutting down."""
+        while True:
+            try:
+                self._handle(self.results.get_nowait())
+            except queue.Empty:
+                return
+
+    def _merge(self, worker: int, prompt_id: str, files: List[str]):
+        """Copy a prompt's stashed outputs from its worker directory into the project tree."""
+        stash = self.work_root / f"worker_{worker}" / 'results' / prompt_id
+        for rel in files:
+            previous = self.merged.get(rel)
+            if previous is not None and previous[1] != prompt_id:
+                logging.warning(f"{rel} from prompt {prompt_id} (worker {worker}) replaces "
+                                f"prompt {previous[1]} (worker {previous[0]})")
+            dest = self.output_root / rel
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(stash / 'files' / rel, dest)
+            self.merged[rel] = (worker, prompt_id)
+
+        results_dir = self.output_root / 'data' / 'results' / prompt_id
+        results_dir.mkdir(parents=True, exist_ok=True)
+        for name in ('ai_2_out.txt', 'ai_3_out.txt'):
+            if (stash / name).exists():
+                shutil.copy2(stash / name, results_dir / name)
+
+    def _commit(self):
+        """Commit and push the merged outputs of the prompts completed so far."""
+        from core.echo_loop import initialize_git, commit_and_push
+        if self.repo is None:
+            self.repo = initialize_git()
+        commit_and_push(self.repo, f"Automated commit - {len(self.completed)} prompts")
+
+    def _write_status(self):
+        try:
+            self.status_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.status_file.with_suffix('.json.tmp')
+            tmp.write_text(json.dumps(self.get_status(), indent=2, default=str), encoding='utf-8')
+            os.replace(tmp, self.status_file)
+        except OSError as e:
+            logging.error(f"Error writing coordinator status: {str(e)}")
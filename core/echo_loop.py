@@ -20,7 +20,15 @@ from automation.file_writer import write_changes
 from agents.gemini_agent import run_gemini_agent
 import git
 from core.task_queue import TaskQueue, Task
+from core.journal import TaskJournal
+from core.tracing import Tracer, span
+from core.pipeline import Pipeline, Stage
+from core.stage_graph import StageGraph
+from core.response_cache import ResponseCache
+from core.timer import retry_delay
 import traceback
+from collections import deque
+from functools import partial
 
 # Set up logging
 log_file = Path(__file__).parent.parent / 'logs' / 'loop.log'
@@ -30,6 +38,23 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Coordinator workers (core.coordinator) each get their own data and output directories
+DATA_DIR = Path(os.environ.get('ECHOLOOP_DATA_DIR') or Path(__file__).parent.parent / 'data')
+OUTPUT_DIR = Path(os.environ.get('ECHOLOOP_OUTPUT_DIR') or Path(__file__).parent.parent)
+journal_file = Path(__file__).parent.parent / 'logs' / 'task_journal.db'
+cache_file = Path(__file__).parent.parent / 'logs' / 'response_cache.db'
+trace_file = Path(__file__).parent.parent / 'logs' / 'trace.json'  # open in ui.perfetto.dev
+
+# Limits for the task queue's named resources (see core.resources)
+RESOURCE_LIMITS = {
+    'browser': {'max_concurrency': 1},  # one WebDriver session, not thread-safe
+    'gemini': {'rate': 15 / 60, 'burst': 1},  # stay under the Gemini per-minute quota
+    'git': {'max_concurrency': 1}
+}
+
+PIPELINE_CAPACITY = 1  # iterations buffered between pipeline stages
+ITERATION_RETRY_DELAY = 5  # seconds before a failed iteration is retried, doubling per failure
+
 def initialize_git():
     """Initialize git repository if not already initialized."""
     try:
@@ -43,10 +68,12 @@ def initialize_git():
 def commit_and_push(repo, message="Automated commit"):
     """Commit changes and push to GitHub."""
     try:
-        repo.index.add('*')
-        repo.index.commit(message)
-        origin = repo.remote('origin')
-        origin.push()
+        with span('git_commit'):
+            repo.index.add('*')
+            repo.index.commit(message)
+        with span('git_push'):
+            origin = repo.remote('origin')
+            origin.push()
         logging.info(f"Successfully committed and pushed changes: {message}")
         return True
     except Exception as e:
@@ -56,7 +83,7 @@ def commit_and_push(repo, message="Automated commit"):
 def read_input():
     """Read input from ai_1_out.txt."""
     try:
-        input_file = Path(__file__).parent.parent / 'data' / 'ai_1_out.txt'
+        input_file = DATA_DIR / 'ai_1_out.txt'
         with open(input_file, 'r', encoding='utf-8') as f:
             return f.read().strip()
     except Exception as e:
@@ -66,7 +93,7 @@ def read_input():
 def save_response(response):
     """Save response to ai_2_out.txt."""
     try:
-        output_file = Path(__file__).parent.parent / 'data' / 'ai_2_out.txt'
+        output_file = DATA_DIR / 'ai_2_out.txt'
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(response)
         return True
@@ -74,117 +101,239 @@ def save_response(response):
         logging.error(f"Error saving response: {str(e)}\n{traceback.format_exc()}")
         return False
 
-def process_iteration(browser, iteration):
-    """Process a single iteration of the automation loop."""
-    try:
-        # Read input
+def chat_stage(browser, iteration):
+    """Send the current input to ChatGPT and return its response."""
+    # Read input
+    with span('read_input'):
         input_text = read_input()
-        if not input_text:
-            raise ValueError("No input text found")
-        
-        # Send message to ChatGPT
-        success, message = browser.send_message(input_text)
-        if not success:
-            raise ValueError(f"Failed to send message: {message}")
-        
-        # Wait for response
-        success, response = browser.wait_for_response()
-        if not success:
-            raise ValueError(f"No response received from ChatGPT: {response}")
-        
-        # Save response
-        if not save_response(response):
-            raise ValueError("Failed to save response")
-        
-        # Run Gemini agent
-        if not run_gemini_agent():
-            raise ValueError("Gemini agent failed")
-        
-        # Capture screen
-        screen_data = capture_screen()
-        if not screen_data.get('success'):
-            raise ValueError(f"Screen capture failed: {screen_data.get('error')}")
-        
-        # Type response
-        if not type_with_retry(response):
-            raise ValueError("Failed to type response")
-        
-        # Write changes
-        if not write_changes():
-            raise ValueError("Failed to write changes")
-        
-        logging.info(f"Completed iteration {iteration}")
-        return True
-    except Exception as e:
-        logging.error(f"Error in iteration {iteration}: {str(e)}\n{traceback.format_exc()}")
-        return False
+    if not input_text:
+        raise ValueError("No input text found")
+    
+    # Send message to ChatGPT and wait for the response (or take it from the cache)
+    success, response = browser.ask(input_text)
+    if not success:
+        raise ValueError(f"No response received from ChatGPT: {response}")
+    return response
+
+def gemini_stage(response, cache=None):
+    """Save a ChatGPT response and have Gemini turn it into an implementation (ai_3_out.txt)."""
+    # Save response
+    with span('save_response'):
+        saved = save_response(response)
+    if not saved:
+        raise ValueError("Failed to save response")
+    
+    # Run Gemini agent
+    with span('gemini'):
+        gemini_ok = run_gemini_agent(cache=cache)
+    if not gemini_ok:
+        raise ValueError("Gemini agent failed")
+    return True
+
+def write_stage(gemini_done):
+    """Apply the implementation Gemini wrote to the codebase."""
+    with span('write_changes'):
+        written = write_changes(DATA_DIR / 'ai_3_out.txt', OUTPUT_DIR)
+    if not written:
+        raise ValueError("Failed to write changes")
+    return True
 
-def main():
-    """Main automation loop."""
+def implement_stage(response, cache=None):
+    """Gemini and write stages back to back, for the pipeline. Returns the response."""
+    write_stage(gemini_stage(response, cache))
+    return response
+
+def capture_stage(response):
+    """Capture and OCR the screen before typing; takes the response only to run after chat.
+    
+    OCR is CPU-bound, so the iteration graph runs this stage on the task
+    queue's process pool.
+    """
+    screen_data = capture_screen()
+    if not screen_data.get('success'):
+        raise ValueError(f"Screen capture failed: {screen_data.get('error')}")
+    return screen_data
+
+def type_stage(response, screen_data=None):
+    """Type a ChatGPT response into the active window, capturing the screen first if not done yet."""
+    if screen_data is None:
+        with span('capture_screen'):
+            capture_stage(response)
+    
+    # Type response
+    with span('type_response'):
+        typed = type_with_retry(response)
+    if not typed:
+        raise ValueError("Failed to type response")
+    return True
+
+def build_iteration_graph(browser, cache=None, typing=True):
+    """Stage graph of one iteration: chat -> gemini -> write, and chat -> capture -> type.
+    
+    Gemini and typing only need the ChatGPT response, so they run
+    concurrently once chat is done. Without ``typing`` the graph stops at
+    write: coordinator workers share one desktop, so none of them may
+    capture it or type into it.
+    """
+    graph = (StageGraph()
+             .add('chat', partial(chat_stage, browser), max_retries=3, retry_delay=5,
+                  resources=['browser'], affinity='browser:0')  # the WebDriver session must stay on one thread
+             .add('gemini', partial(gemini_stage, cache=cache), after=['chat'], max_retries=3, retry_delay=5,
+                  resources=['gemini'])
+             .add('write', write_stage, after=['gemini'], max_retries=3, retry_delay=5))
+    if typing:
+        # Capture and typing drive the same desktop session as the browser
+        graph.add('capture', capture_stage, after=['chat'], max_retries=3, retry_delay=5,
+                  resources=['browser'], executor='process')
+        graph.add('type', type_stage, after=['chat', 'capture'], max_retries=3, retry_delay=5,
+                  resources=['browser'])
+    return graph
+
+def build_pipeline(task_queue, browser, cache=None):
+    """Iteration pipeline: chat -> implement -> type, each stage on the task queue."""
+    return Pipeline(task_queue, [
+        Stage('chat', partial(chat_stage, browser), max_retries=3, retry_delay=5,
+              resources=['browser'], affinity='browser:0'),
+        Stage('implement', partial(implement_stage, cache=cache), max_retries=3, retry_delay=5, resources=['gemini']),
+        # Typing drives the same desktop session as the browser, so it never overlaps a chat
+        Stage('type', type_stage, max_retries=3, retry_delay=5, resources=['browser'])
+    ], capacity=PIPELINE_CAPACITY, priority=1)
+
+def submit_commit(task_queue, repo, iteration):
+    """Commit and push on the task queue, waiting for the outcome. Returns True on success."""
+    commit_task = Task(
+        f"commit_{iteration}",
+        commit_and_push,
+        args=(repo, f"Automated commit - iteration {iteration}"),
+        max_retries=2,
+        retry_delay=10,
+        resources=['git'],
+        idempotency_key=f"commit_{iteration}"
+    )
+    commit_future = task_queue.submit(commit_task, priority=0)
+    return commit_future.exception() is None
+
+def run_pipelined(task_queue, browser, cache, repo, journal, iteration, last_commit_iteration):
+    """Main loop of pipelined mode: keep the iteration pipeline fed until interrupted.
+    
+    Iteration n+1 is sent to ChatGPT while iteration n is still with
+    Gemini. Failed iterations are fed again, and the journal's
+    'iteration' is the oldest iteration not yet completed, so a restart
+    resumes from there. Iterations after it that already completed are
+    kept in 'completed_iterations' and skipped on resume, as the pipeline
+    has cleared their checkpoints.
+    """
+    pipeline = build_pipeline(task_queue, browser, cache)
+    pipeline.start()
+    in_flight = {}  # iteration -> Future
+    retry = deque()  # (iteration, monotonic time it may be fed again) of failed iterations
+    failures = {}  # iteration -> consecutive failures
+    completed = {number for number in journal.get_state('completed_iterations', []) if number > iteration}
+    try:
+        while True:
+            # Feed the next iteration; blocks while the first stage is backed up
+            if retry:
+                number, not_before = retry.popleft()
+                time.sleep(max(not_before - time.monotonic(), 0))
+            else:
+                while iteration in completed:
+                    iteration += 1  # completed before a restart
+                number, iteration = iteration, iteration + 1
+            in_flight[number] = pipeline.put(f"iteration_{number}", number)
+            
+            for number, future in sorted(in_flight.items()):
+                if not future.done():
+                    continue
+                del in_flight[number]
+                if future.exception() is not None:
+                    failures[number] = failures.get(number, 0) + 1
+                    delay = retry_delay(ITERATION_RETRY_DELAY, failures[number])
+                    logging.error(f"Iteration {number} failed: {str(future.exception())}; retrying in {delay:.0f}s")
+                    retry.append((number, time.monotonic() + delay))
+                    continue
+                failures.pop(number, None)
+                completed.add(number)
+                logging.info(f"Completed iteration {number}")
+                # Commit and push every 25 iterations
+                if number - last_commit_iteration >= 25 and submit_commit(task_queue, repo, number):
+                    last_commit_iteration = number
+                    journal.set_state('last_commit_iteration', last_commit_iteration)
+            oldest = min([*in_flight, *(number for number, _ in retry), iteration])
+            completed = {number for number in completed if number > oldest}
+            journal.set_state('completed_iterations', sorted(completed))
+            journal.set_state('iteration', oldest)
+    except KeyboardInterrupt:
+        logging.info("Received keyboard interrupt, stopping...")
+    finally:
+        pipeline.close()
+        pipeline.join(timeout=5)
+        logging.info(f"Pipeline stage stats: {pipeline.stats()}")
+
+def main(pipelined=False):
+    """Main automation loop.
+    
+    With ``pipelined`` the stages of consecutive iterations overlap (see
+    run_pipelined); otherwise each iteration finishes before the next starts.
+    """
     # Initialize git
     repo = initialize_git()
     
-    # Initialize task queue
-    task_queue = TaskQueue(max_workers=2)
+    # Initialize task queue; an interrupted iteration resumes from its last completed stage
+    journal = TaskJournal(journal_file)
+    tracer = Tracer()
+    task_queue = TaskQueue(min_workers=1, max_workers=4, max_finished_tasks=500, journal=journal,
+                           resources=RESOURCE_LIMITS, aging_interval=60, tracer=tracer)
     task_queue.start()
+    # Stage tasks left unfinished are not re-run on their own: rerunning the
+    # iteration restores its completed stages from the journal's checkpoints
+    for row in journal.unfinished():
+        journal.mark_abandoned(row['task_id'])
     
-    # Initialize browser
-    browser = BrowserController()
+    # Initialize browser; unchanged prompts are answered from the response cache
+    cache = ResponseCache(cache_file)
+    browser = BrowserController(cache=cache)
     success, message = browser.initialize()
     if not success:
         logging.error(f"Failed to initialize browser: {message}")
         return
     
-    iteration = 0
-    last_commit_iteration = 0
+    iteration = journal.get_state('iteration', 0)
+    last_commit_iteration = journal.get_state('last_commit_iteration', 0)
+    if iteration:
+        logging.info(f"Resuming from iteration {iteration} (last commit at {last_commit_iteration})")
     
     try:
+        if pipelined:
+            run_pipelined(task_queue, browser, cache, repo, journal, iteration, last_commit_iteration)
+            return
+        
+        iteration_graph = build_iteration_graph(browser, cache)
+        failures = 0  # consecutive failed runs of the current iteration
         while True:
             try:
-                # Create tasks for this iteration
-                iteration_task = Task(
-                    f"iteration_{iteration}",
-                    process_iteration,
-                    args=(browser, iteration),
-                    max_retries=3,
-                    retry_delay=5
-                )
-                
-                # Add iteration task with high priority
-                iteration_task_id = task_queue.add_task(iteration_task, priority=1)
-                
-                # Wait for iteration task completion
-                while True:
-                    status = task_queue.get_task_status(iteration_task_id)
-                    if status['status'] in ['completed', 'failed']:
-                        if status['status'] == 'failed':
-                            logging.error(f"Iteration {iteration} failed: {status['error']}")
-                            # Retry the entire iteration
-                            continue
-                        break
-                    time.sleep(1)
+                # Run this iteration's stages with high priority and wait for them to finish
+                iteration_future = iteration_graph.run(task_queue, f"iteration_{iteration}", iteration, priority=1)
+                try:
+                    run = iteration_future.result()
+                except Exception as e:
+                    failures += 1
+                    delay = retry_delay(ITERATION_RETRY_DELAY, failures)
+                    logging.error(f"Iteration {iteration} failed: {str(e)}; retrying in {delay:.0f}s")
+                    # Retry the iteration with backoff; completed stages are restored and
+                    # stages still running from the failed run are reused
+                    time.sleep(delay)
+                    continue
+                failures = 0
+                logging.info(f"Completed iteration {iteration} (* = critical path): {run.summary()}")
                 
                 # Commit and push every 25 iterations
                 if iteration - last_commit_iteration >= 25:
-                    commit_task = Task(
-                        f"commit_{iteration}",
-                        commit_and_push,
-                        args=(repo, f"Automated commit - iteration {iteration}"),
-                        max_retries=2,
-                        retry_delay=10
-                    )
-                    commit_task_id = task_queue.add_task(commit_task, priority=0)
-                    
-                    # Wait for commit task completion
-                    while True:
-                        status = task_queue.get_task_status(commit_task_id)
-                        if status['status'] in ['completed', 'failed']:
-                            if status['status'] == 'completed':
-                                last_commit_iteration = iteration
-                            break
-                        time.sleep(1)
+                    if submit_commit(task_queue, repo, iteration):
+                        last_commit_iteration = iteration
+                        journal.set_state('last_commit_iteration', last_commit_iteration)
                 
                 iteration += 1
+                journal.set_state('iteration', iteration)
                 
             except KeyboardInterrupt:
                 logging.info("Received keyboard interrupt, stopping...")
@@ -196,7 +345,15 @@ def main():
     finally:
         # Cleanup
         task_queue.stop()
+        journal.close()
         browser.close()
+        logging.info(f"Response cache: {cache.stats()}")
+        cache.close()
+        try:
+            count = tracer.export_chrome_trace(trace_file)
+            logging.info(f"Wrote {count} trace spans to {trace_file}")
+        except OSError as e:
+            logging.error(f"Error writing trace: {str(e)}")
         logging.info("Automation loop stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Executor backends that TaskQueue routes task attempts to
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+# 'thread'  - run on the TaskQueue worker thread (default, for I/O-bound work)
+# 'process' - run in a process pool so CPU-bound work is not limited by the GIL
+# 'inline'  - run the first attempt synchronously in the thread that adds the task
+EXECUTORS = ('thread', 'process', 'inline')
+
+def check_picklable(func: Callable, args: tuple, kwargs: dict):
+    """Raise ValueError if a call cannot be sent to a worker process."""
+    try:
+        pickle.dumps((func, args, kwargs))
+    except Exception as e:
+        name = getattr(func, '__qualname__', repr(func))
+        raise ValueError(f"Process task {name} must be picklable "
+                         f"(module-level function and arguments): {str(e)}") from e
+
+class ProcessBackend:
+    """Lazily started process pool shared by all 'process' tasks of a queue.
+
+    ``run`` blocks the calling worker thread until the child process
+    returns; the result is unpickled in the parent and any exception raised
+    in the child is re-raised with the remote traceback attached.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def run(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        pool = self._get_pool()
+        try:
+            return pool.submit(func, *args, **kwargs).result()
+        except BrokenProcessPool:
+            # A child died (e.g. killed or crashed); start a fresh pool for the retry
+            logging.error("Process pool broke, restarting it")
+            with self.lock:
+                if self.pool is pool:
+                    self.pool = None
+            pool.shutdown(wait=False)
+            raise
+
+    def shutdown(self, timeout: float = 5):
+        """Stop the pool, terminating children still busy after ``timeout`` seconds.
+
+        A timed-out attempt may have left a child hung in its call, so
+        this does not wait on the pool indefinitely.
+        """
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if not pool:
+            return
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+        hung = [process for process in processes if process.is_alive()]
+        for process in hung:
+            process.terminate()
+        for process in hung:
+            process.join(1)
+        if hung:
+            logging.warning(f"Terminated {len(hung)} process pool workers still running at shutdown")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.max_workers)
+                logging.info(f"Started process pool with {self.max_workers or os.cpu_count()} workers")
+            return self.pool
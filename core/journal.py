@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Crash-safe SQLite journal for TaskQueue state
+"""
+
+import json
+import logging
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    func TEXT,
+    payload BLOB,
+    priority INTEGER,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    created_at REAL,
+    updated_at REAL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_id TEXT,
+    event TEXT,
+    attempt INTEGER,
+    at REAL,
+    detail TEXT
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_key TEXT,
+    stage TEXT,
+    output BLOB,
+    saved_at REAL,
+    PRIMARY KEY (run_key, stage)
+);
+"""
+
+CHECKPOINT_MAX_AGE = 7 * 24 * 3600  # checkpoints of runs that never finished are dropped after this
+
+_FLUSH = object()
+_STOP = object()
+
+class TaskJournal:
+    """Write-ahead journal of task lifecycle events backed by SQLite in WAL mode.
+
+    Events are handed to a single writer thread which commits everything
+    that queued up since its last commit in one transaction (group commit),
+    so a burst of task transitions costs one fsync instead of one each.
+    ``flush()`` blocks until all earlier events are durable. Batches form
+    naturally while the previous commit is syncing; ``commit_interval``
+    (seconds) can add a short linger to make them larger.
+
+    Besides task events the journal keeps a small key/value ``state`` table
+    that the loop uses for counters that must survive a restart, and a
+    ``checkpoints`` table of stage outputs keyed by run and stage, so a
+    retried run can skip the stages that already completed.
+    """
+
+    def __init__(self, path, commit_interval: float = 0.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_interval = commit_interval
+        self.pending = queue.Queue()
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        # Tasks that finished before the last shutdown are no longer needed
+        conn.execute("DELETE FROM events WHERE task_id IN "
+                     "(SELECT task_id FROM tasks WHERE status IN ('completed', 'failed', 'cancelled', 'abandoned'))")
+        conn.execute("DELETE FROM tasks WHERE status IN ('completed', 'failed', 'cancelled', 'abandoned')")
+        conn.execute("DELETE FROM checkpoints WHERE saved_at < ?", (time.time() - CHECKPOINT_MAX_AGE,))
+        conn.commit()
+        self.state = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM state")}
+        self.checkpoints: Dict[str, Dict[str, bytes]] = {}  # run key -> stage -> pickled output
+        for row in conn.execute("SELECT run_key, stage, output FROM checkpoints"):
+            self.checkpoints.setdefault(row['run_key'], {})[row['stage']] = row['output']
+        self.checkpoints_lock = threading.Lock()
+        self.unfinished_rows = [dict(row) for row in conn.execute(
+            "SELECT task_id, func, payload, priority, status, attempts FROM tasks ORDER BY created_at")]
+        conn.close()
+
+        self.writer = threading.Thread(target=self._writer_loop, name="TaskJournalWriter", daemon=True)
+        self.writer.start()
+
+    def record_enqueue(self, task, priority: int):
+        func = f"{getattr(task.func, '__module__', '?')}:{getattr(task.func, '__qualname__', repr(task.func))}"
+        try:
+            payload = pickle.dumps((task.func, task.args, task.kwargs, task.max_retries, task.retry_delay))
+        except Exception:
+            payload = None  # e.g. tasks bound to a live browser session; the caller rebuilds these
+        now = time.time()
+        self._put("INSERT OR REPLACE INTO tasks "
+                  "(task_id, func, payload, priority, status, attempts, created_at, updated_at) "
+                  "VALUES (?, ?, ?, ?, 'pending', 0, ?, ?)",
+                  (task.task_id, func, payload, priority, now, now))
+        self._event(task.task_id, 'enqueue', 0, now)
+
+    def record_start(self, task_id: str, attempt: int):
+        now = time.time()
+        self._put("UPDATE tasks SET status = 'running', attempts = ?, updated_at = ? WHERE task_id = ?",
+                  (attempt, now, task_id))
+        self._event(task_id, 'start', attempt, now)
+
+    def record_retry(self, task_id: str, attempt: int, delay: float, error: str):
+        now = time.time()
+        self._put("UPDATE tasks SET status = 'pending', updated_at = ? WHERE task_id = ?", (now, task_id))
+        self._event(task_id, 'retry', attempt, now, json.dumps({'delay': delay, 'error': error}))
+
+    def record_finish(self, task_id: str, status: str, attempt: int, error: Optional[str] = None):
+        now = time.time()
+        self._put("UPDATE tasks SET status = ?, attempts = ?, updated_at = ? WHERE task_id = ?",
+                  (status, attempt, now, task_id))
+        self._event(task_id, status, attempt, now, json.dumps({'error': error}) if error else None)
+
+    def set_state(self, key: str, value: Any):
+        """Persist a JSON-serialisable value under key."""
+        self.state[key] = value
+        self._put("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def get_state(self, key: str, default: Any = None) -> Any:
+        return self.state.get(key, default)
+
+    def save_checkpoint(self, run_key: str, stage: str, output: Any, timeout: Optional[float] = 10) -> bool:
+        """Durably record a stage's output; returns False if it cannot be pickled.
+
+        Blocks until the checkpoint is committed (up to ``timeout``), so a
+        crash right after the stage cannot make it run again.
+        """
+        try:
+            blob = pickle.dumps(output)
+        except Exception as e:
+            logging.warning(f"Not checkpointing stage {stage} of {run_key}: output is not picklable ({str(e)})")
+            return False
+        with self.checkpoints_lock:
+            self.checkpoints.setdefault(run_key, {})[stage] = blob
+        self._put("INSERT OR REPLACE INTO checkpoints (run_key, stage, output, saved_at) VALUES (?, ?, ?, ?)",
+                  (run_key, stage, blob, time.time()))
+        self.flush(timeout)
+        return True
+
+    def load_checkpoints(self, run_key: str) -> Dict[str, Any]:
+        """Outputs of the stages of run_key that were checkpointed, by stage."""
+        with self.checkpoints_lock:
+            blobs = dict(self.checkpoints.get(run_key, {}))
+        outputs = {}
+        for stage, blob in blobs.items():
+            try:
+                outputs[stage] = pickle.loads(blob)
+            except Exception as e:
+                logging.error(f"Could not restore checkpoint of stage {stage} of {run_key}: {str(e)}")
+        return outputs
+
+    def clear_checkpoints(self, run_key: str):
+        """Forget the checkpoints of a run that finished."""
+        with self.checkpoints_lock:
+            if self.checkpoints.pop(run_key, None) is None:
+                return
+        self._put("DELETE FROM checkpoints WHERE run_key = ?", (run_key,))
+
+    def unfinished(self) -> List[Dict[str, Any]]:
+        """Tasks that were pending or running when the journal was last closed."""
+        return list(self.unfinished_rows)
+
+    def mark_abandoned(self, task_id: str):
+        """Mark an unfinished task from a previous run as not resumed."""
+        self.record_finish(task_id, 'abandoned', 0)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every event recorded so far has been committed."""
+        done = threading.Event()
+        self.pending.put((_FLUSH, done))
+        return done.wait(timeout)
+
+    def close(self):
+        self.pending.put((_STOP, None))
+        self.writer.join(timeout=10)
+
+    def _event(self, task_id: str, event: str, attempt: int, at: float, detail: Optional[str] = None):
+        self._put("INSERT INTO events (task_id, event, attempt, at, detail) VALUES (?, ?, ?, ?, ?)",
+                  (task_id, event, attempt, at, detail))
+
+    def _put(self, sql: str, params: tuple):
+        self.pending.put((sql, params))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def _writer_loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch = [self.pending.get()]
+            # Let more events pile up so they share one commit
+            deadline = time.monotonic() + self.commit_interval
+            while True:
+                try:
+                    batch.append(self.pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            waiters = []
+            try:
+                with conn:
+                    for sql, params in batch:
+                        if sql is _FLUSH:
+                            waiters.append(params)
+                        elif sql is _STOP:
+                            stopping = True
+                        else:
+                            conn.execute(sql, params)
+            except sqlite3.Error as e:
+                logging.error(f"Task journal write failed ({len(batch)} events): {str(e)}\n{traceback.format_exc()}")
+            for done in waiters:
+                done.set()
+        conn.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Staged pipeline that overlaps consecutive items on a TaskQueue
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from core.task_queue import TaskQueue, Task
+
+class Stage:
+    """One step of a Pipeline.
+
+    ``func`` takes the previous stage's output (the item itself for the
+    first stage) and returns this stage's output. ``task_options`` are
+    passed to the Task each item runs as, e.g. ``max_retries``,
+    ``resources`` or ``affinity``.
+    """
+
+    def __init__(self, name: str, func: Callable[[Any], Any], **task_options):
+        self.name = name
+        self.func = func
+        self.task_options = task_options
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0  # seconds spent running items
+        self.starved = 0.0  # seconds spent waiting for input
+        self.blocked = 0.0  # seconds spent waiting for room in the next stage's queue
+
+    def stats(self) -> Dict[str, Any]:
+        return {'processed': self.processed, 'failed': self.failed, 'busy': round(self.busy, 3),
+                'starved': round(self.starved, 3), 'blocked': round(self.blocked, 3)}
+
+class Pipeline:
+    """Runs items through a fixed sequence of stages, overlapping consecutive items.
+
+    Each stage takes one item at a time, in order, and runs it as a task on
+    the TaskQueue, so the queue's retries, resources, affinity and tracing
+    apply per stage. Item n can be in stage k while item n+1 is in stage
+    k-1, and throughput approaches that of the slowest stage rather than
+    the sum of all stages. Stages are separated by queues of ``capacity``
+    items: when a stage falls behind the ones before it block, and ``put``
+    blocks once the first stage's queue is full.
+
+    An item whose stage fails for good skips the remaining stages; its
+    future raises the stage's error. Stage tasks carry idempotency keys, so
+    feeding the same key again reuses the output of stages that completed
+    within the queue's ``idempotency_ttl`` instead of running them twice.
+    With a journal on the queue each stage's output is also checkpointed
+    under the item's key, so this holds across restarts too (see
+    core.stage_graph.StageGraph).
+    """
+
+    def __init__(self, task_queue: TaskQueue, stages: List[Stage], capacity: int = 1, priority: int = 0):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.task_queue = task_queue
+        self.stages = stages
+        self.priority = priority
+        self.inboxes = [queue.Queue(maxsize=capacity) for _ in stages]
+        self.threads: List[threading.Thread] = []
+        self.closed = False
+
+    def start(self):
+        for index, stage in enumerate(self.stages):
+            thread = threading.Thread(target=self._run_stage, args=(index,), name=f"PipelineStage-{stage.name}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        logging.info(f"Started pipeline with stages {[stage.name for stage in self.stages]}")
+
+    def put(self, key: str, item: Any, timeout: Optional[float] = None) -> Future:
+        """Feed an item, blocking while the first stage is backed up.
+
+        ``key`` names the item's tasks (``f"{key}.{stage}"``) and is used as
+        their idempotency key prefix. Returns a Future for the last stage's
+        output.
+        """
+        if self.closed:
+            raise RuntimeError("Pipeline is closed")
+        future = Future()
+        self.inboxes[0].put((key, item, future), timeout=timeout)
+        return future
+
+    def close(self):
+        """Stop accepting items; stages exit once the items already fed are through."""
+        if not self.closed:
+            self.closed = True
+            self.inboxes[0].put(None)
+
+    def join(self, timeout: Optional[float] = None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {stage.name: {**stage.stats(), 'queued': inbox.qsize()}
+                for stage, inbox in zip(self.stages, self.inboxes)}
+
+    def _run_stage(self, index: int):
+        """Stage thread: run each item of this stage's queue on the task queue, in order."""
+        stage = self.stages[index]
+        inbox = self.inboxes[index]
+        outbox = self.inboxes[index + 1] if index + 1 < len(self.stages) else None
+        journal = self.task_queue.journal
+        while True:
+            waiting = time.monotonic()
+            entry = inbox.get()
+            started = time.monotonic()
+            stage.starved += started - waiting
+            if entry is None:
+                if outbox is not None:
+                    outbox.put(None)
+                return
+
+            key, item, future = entry
+            saved = journal.load_checkpoints(key) if journal else {}
+            name = f"{key}.{stage.name}"
+            task = Task(name, stage.func, args=(item,), idempotency_key=name, **stage.task_options)
+            try:
+                if stage.name in saved:
+                    result = saved[stage.name]
+                else:
+                    result = self.task_queue.submit(task, self.priority).result()
+                    if journal:
+                        journal.save_checkpoint(key, stage.name, result)
+            except Exception as e:
+                stage.failed += 1
+                stage.busy += time.monotonic() - started
+                logging.error(f"Pipeline stage {stage.name} failed for {key}: {str(e)}")
+                future.set_exception(e)
+                continue
+            finished = time.monotonic()
+            stage.processed += 1
+            stage.busy += finished - started
+
+            if outbox is None:
+                if journal:
+                    journal.clear_checkpoints(key)
+                future.set_result(result)
+            else:
+                outbox.put((key, result, future))
+                stage.blocked += time.monotonic() - finished
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Named resource classes with token-bucket rate limits and concurrency caps
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class Resource:
+    """A shared resource that tasks declare they need, e.g. 'gemini' or 'browser'.
+
+    ``rate`` is the sustained number of task starts per second (token bucket
+    refilled continuously, holding at most ``burst`` tokens) and
+    ``max_concurrency`` caps how many tasks may hold the resource at once.
+    Either limit may be None for unlimited. Not thread-safe; TaskQueue only
+    touches resources with its lock held.
+    """
+
+    def __init__(self, name: str, rate: Optional[float] = None, burst: Optional[float] = None,
+                 max_concurrency: Optional[int] = None):
+        if rate is not None and rate <= 0:
+            raise ValueError(f"Resource {name}: rate must be positive")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"Resource {name}: max_concurrency must be at least 1")
+        self.name = name
+        self.rate = rate
+        self.burst = burst if burst is not None else (max(rate, 1.0) if rate else None)
+        self.max_concurrency = max_concurrency
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.in_use = 0
+        self.waiting = OrderedDict()  # task_id -> Task parked until this resource frees up
+        self.wakeup = None  # TimerHandle for the next token refill, if one is scheduled
+
+    def _refill(self, now: float):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+
+    def available(self, now: float) -> int:
+        """How many more tasks could acquire the resource right now."""
+        self._refill(now)
+        free = float('inf')
+        if self.max_concurrency is not None:
+            free = self.max_concurrency - self.in_use
+        if self.rate is not None:
+            free = min(free, int(self.tokens))
+        return max(free, 0)
+
+    def refill_delay(self) -> float:
+        """Seconds until the next token is available (0 if one already is)."""
+        if self.rate is None or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        if self.rate is not None:
+            self.tokens -= 1
+        self.in_use += 1
+
+    def release(self):
+        self.in_use -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_use': self.in_use,
+            'max_concurrency': self.max_concurrency,
+            'rate': self.rate,
+            'tokens': round(self.tokens, 2) if self.rate is not None else None,
+            'waiting': len(self.waiting)
+        }
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Persistent content-addressed cache for ChatGPT and Gemini responses
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    namespace TEXT,
+    value TEXT,
+    size INTEGER,
+    expires_at REAL,
+    used_at REAL
+);
+"""
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a prompt for keying: NFC, LF newlines, no trailing whitespace."""
+    text = unicodedata.normalize('NFC', prompt).replace('\r\n', '\n').replace('\r', '\n')
+    return '\n'.join(line.rstrip() for line in text.strip().split('\n'))
+
+class ResponseCache:
+    """SQLite-backed response cache keyed by a hash of the prompt and backend.
+
+    The key is the SHA-256 of ``namespace`` (e.g. 'chatgpt'), ``identity``
+    (the model or endpoint that answers) and the normalized prompt, so the
+    same question to a different model is a different entry. Entries live
+    for ``ttl`` seconds; when the stored responses exceed ``max_bytes`` the
+    least recently used ones are evicted. The LRU order is kept in memory
+    and persisted as each entry's last-use time, so it survives restarts.
+    Hit and miss counters per namespace are reported by ``stats()``.
+    Safe to use from any thread.
+    """
+
+    def __init__(self, path, max_bytes: int = 64 * 1024 * 1024, ttl: float = 7 * 24 * 3600):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self.conn.commit()
+
+        self.index = OrderedDict()  # key -> (size, expires_at), least recently used first
+        self.total_bytes = 0
+        for key, size, expires_at in self.conn.execute(
+                "SELECT key, size, expires_at FROM responses ORDER BY used_at"):
+            self.index[key] = (size, expires_at)
+            self.total_bytes += size
+        self.counters: Dict[str, Dict[str, int]] = {}  # namespace -> hits/misses
+        self.evictions = 0
+        self.expired = 0
+        with self.lock:
+            self._evict()
+            self.conn.commit()
+
+    @staticmethod
+    def key(namespace: str, identity: str, prompt: str) -> str:
+        text = '\0'.join((namespace, identity, normalize_prompt(prompt)))
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def get(self, namespace: str, identity: str, prompt: str) -> Optional[str]:
+        """Cached response for prompt, or None on a miss."""
+        key = self.key(namespace, identity, prompt)
+        now = time.time()
+        with self.lock:
+            counters = self.counters.setdefault(namespace, {'hits': 0, 'misses': 0})
+            entry = self.index.get(key)
+            if entry is not None and entry[1] < now:
+                self._delete(key)
+                self.conn.commit()
+                self.expired += 1
+                entry = None
+            row = None
+            if entry is not None:
+                row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                counters['misses'] += 1
+                return None
+            self.index.move_to_end(key)
+            self.conn.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            counters['hits'] += 1
+        logging.info(f"Response cache hit ({namespace}, {key[:12]})")
+        return row[0]
+
+    def put(self, namespace: str, identity: str, prompt: str, response: str, ttl: Optional[float] = None):
+        """Store a response, evicting least recently used entries if over ``max_bytes``."""
+        key = self.key(namespace, identity, prompt)
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self.lock:
+            if key in self.index:
+                self.total_bytes -= self.index.pop(key)[0]
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, namespace, value, size, expires_at, used_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (key, namespace, response, size, expires_at, now))
+            self.index[key] = (size, expires_at)
+            self.total_bytes += size
+            self._evict()
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            namespaces = {namespace: dict(counters) for namespace, counters in self.counters.items()}
+            hits = sum(counters['hits'] for counters in namespaces.values())
+            misses = sum(counters['misses'] for counters in namespaces.values())
+            return {
+                'entries': len(self.index),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'evictions': self.evictions,
+                'expired': self.expired,
+                'namespaces': namespaces
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _evict(self):
+        """Drop least recently used entries until under max_bytes. Must be called with the lock held."""
+        while self.total_bytes > self.max_bytes and self.index:
+            key = next(iter(self.index))
+            self._delete(key)
+            self.evictions += 1
+
+    def _delete(self, key: str):
+        """Must be called with the lock held."""
+        self.total_bytes -= self.index.pop(key)[0]
+        self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Indexed binary heap used by the EchoLoop task schedulers
+"""
+
+import itertools
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+class IndexedHeap:
+    """Binary min-heap with a position index for O(log n) removal and re-keying.
+
+    Entries are ordered by ``(key, seq)`` where ``seq`` is a monotonic
+    sequence number assigned on push, so items with equal keys come out in
+    FIFO order and the stored items themselves are never compared.
+    """
+
+    def __init__(self):
+        self._heap: List[list] = []  # [key, seq, item_id, item]
+        self._pos: Dict[Hashable, int] = {}  # item_id -> index in _heap
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, item_id: Hashable) -> bool:
+        return item_id in self._pos
+
+    def push(self, item_id: Hashable, item: Any, key: Any):
+        """Insert an item. Raises KeyError if the id is already queued."""
+        if item_id in self._pos:
+            raise KeyError(f"{item_id} is already queued")
+        entry = [key, next(self._seq), item_id, item]
+        self._heap.append(entry)
+        self._pos[item_id] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def push_many(self, entries: Iterable[Tuple[Hashable, Any, Any]]):
+        """Insert ``(item_id, item, key)`` triples in order.
+
+        A batch at least as large as the heap is appended and the heap is
+        rebuilt bottom-up in O(n + k); smaller batches are pushed one by one.
+        Raises KeyError, inserting nothing, if any id is already queued.
+        """
+        entries = list(entries)
+        ids = set()
+        for item_id, _, _ in entries:
+            if item_id in self._pos or item_id in ids:
+                raise KeyError(f"{item_id} is already queued")
+            ids.add(item_id)
+        if len(entries) < len(self._heap):
+            for item_id, item, key in entries:
+                self.push(item_id, item, key)
+            return
+        heap = self._heap
+        for item_id, item, key in entries:
+            self._pos[item_id] = len(heap)
+            heap.append([key, next(self._seq), item_id, item])
+        for index in reversed(range(len(heap) // 2)):
+            self._sift_down(index)
+
+    def pop(self) -> Tuple[Hashable, Any]:
+        """Remove and return ``(item_id, item)`` with the smallest key."""
+        if not self._heap:
+            raise IndexError("pop from empty heap")
+        entry = self._remove_at(0)
+        return entry[2], entry[3]
+
+    def peek(self) -> Optional[Tuple[Hashable, Any]]:
+        """Return ``(item_id, item)`` with the smallest key without removing it."""
+        if not self._heap:
+            return None
+        entry = self._heap[0]
+        return entry[2], entry[3]
+
+    def remove(self, item_id: Hashable) -> Any:
+        """Remove an item by id and return it. Raises KeyError if absent."""
+        index = self._pos[item_id]
+        return self._remove_at(index)[3]
+
+    def update(self, item_id: Hashable, key: Any):
+        """Change the key of a queued item, keeping its original sequence number."""
+        index = self._pos[item_id]
+        entry = self._heap[index]
+        old_key = entry[0]
+        entry[0] = key
+        if key < old_key:
+            self._sift_up(index)
+        else:
+            self._sift_down(index)
+
+    def key_of(self, item_id: Hashable) -> Any:
+        """Return the current key of a queued item."""
+        return self._heap[self._pos[item_id]][0]
+
+    def items(self):
+        """Iterate over ``(item_id, item)`` pairs in heap (not sorted) order."""
+        for entry in self._heap:
+            yield entry[2], entry[3]
+
+    def _remove_at(self, index: int) -> list:
+        heap = self._heap
+        entry = heap[index]
+        last = heap.pop()
+        del self._pos[entry[2]]
+        if index < len(heap):
+            heap[index] = last
+            self._pos[last[2]] = index
+            self._sift_down(index)
+            self._sift_up(index)
+        return entry
+
+    def _sift_up(self, index: int):
+        heap = self._heap
+        entry = heap[index]
+        order = (entry[0], entry[1])
+        while index > 0:
+            parent = (index - 1) >> 1
+            parent_entry = heap[parent]
+            if order < (parent_entry[0], parent_entry[1]):
+                heap[index] = parent_entry
+                self._pos[parent_entry[2]] = index
+                index = parent
+            else:
+                break
+        heap[index] = entry
+        self._pos[entry[2]] = index
+
+    def _sift_down(self, index: int):
+        heap = self._heap
+        size = len(heap)
+        entry = heap[index]
+        order = (entry[0], entry[1])
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            right = child + 1
+            if right < size and (heap[right][0], heap[right][1]) < (heap[child][0], heap[child][1]):
+                child = right
+            child_entry = heap[child]
+            if (child_entry[0], child_entry[1]) < order:
+                heap[index] = child_entry
+                self._pos[child_entry[2]] = index
+                index = child
+            else:
+                break
+        heap[index] = entry
+        self._pos[entry[2]] = index
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Declarative stage graphs whose independent branches run concurrently on a TaskQueue
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterable, List
+
+from core.task_queue import TaskQueue, Task
+
+class GraphStage:
+    """A node of a StageGraph: ``func`` is called with the outputs of ``after``, in order."""
+
+    def __init__(self, name: str, func: Callable, after: List[str], task_options: Dict[str, Any]):
+        self.name = name
+        self.func = func
+        self.after = after
+        self.task_options = task_options
+
+class GraphRun:
+    """Outputs and timings of one run of a StageGraph.
+
+    ``timings`` maps each stage to seconds since the run started at which
+    its task was submitted and finished; ``duration`` includes queue wait
+    and retries, and ``checkpointed`` stages were restored, not run.
+    ``critical_path`` is the chain of stages that determined the run's wall
+    time: the last stage to finish, the dependency it waited for last, and
+    so on back to a root.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.started = time.monotonic()
+        self.outputs: Dict[str, Any] = {}
+        self.timings: Dict[str, Dict[str, Any]] = OrderedDict()
+        self.critical_path: List[str] = []
+        self.wall_time = None
+
+    def summary(self) -> str:
+        """One line per run, e.g. ``chat 9.1s* -> gemini 4.0s* -> write 0.2s*; type 3.1s``."""
+        critical = ' -> '.join(self._describe(name) + '*' for name in self.critical_path)
+        others = ', '.join(self._describe(name) for name, timing in self.timings.items() if not timing['critical'])
+        return f"{self.key} in {self.wall_time:.1f}s: {critical}" + (f"; {others}" if others else '')
+
+    def _describe(self, name: str) -> str:
+        timing = self.timings[name]
+        return f"{name} (checkpoint)" if timing['checkpointed'] else f"{name} {timing['duration']:.1f}s"
+
+class StageGraph:
+    """A DAG of stages with explicit data edges, run as tasks on a TaskQueue.
+
+    Stages are added with the stages whose outputs they take; a stage can
+    only depend on stages added before it, so the graph is acyclic by
+    construction. ``run`` submits every stage whose inputs are ready, so
+    independent branches run concurrently, each with its own retries,
+    resources and affinity. Root stages are called with the run's ``args``.
+
+    With a tracer on the queue, each finished run is also recorded as a
+    span with a child span per stage flagged ``critical`` or not.
+
+    With a journal on the queue, each stage's output is checkpointed under
+    the run's key as soon as the stage completes. Running the same key again,
+    after a failure or a restart, restores those outputs instead of running
+    the stages, so only the failed stage and the ones after it run again.
+    The checkpoints are cleared once the run succeeds.
+
+    Stage tasks are named and idempotency-keyed ``f"{key}.{stage}"``, so
+    running the same key again after a failure reuses stages that completed
+    within the queue's ``idempotency_ttl``, and waits on the futures of
+    stages of the failed run that are still queued or running instead of
+    submitting them again.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, GraphStage] = OrderedDict()
+        self.dependents: Dict[str, List[str]] = {}
+
+    def add(self, name: str, func: Callable, after: Iterable[str] = (), **task_options) -> 'StageGraph':
+        """Add a stage; ``task_options`` are passed to its Task. Returns the graph for chaining."""
+        after = list(after)
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already defined")
+        unknown = [dep for dep in after if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on undefined stages {unknown}")
+        self.stages[name] = GraphStage(name, func, after, task_options)
+        self.dependents[name] = []
+        for dep in after:
+            self.dependents[dep].append(name)
+        return self
+
+    def run(self, task_queue: TaskQueue, key: str, *args, priority: int = 0) -> Future:
+        """Start a run and return a Future for its GraphRun.
+
+        The future fails with the error of the first stage that fails for
+        good; stages depending on it are not run.
+        """
+        if not self.stages:
+            raise ValueError("A stage graph needs at least one stage")
+        run = GraphRun(key)
+        future = Future()
+        lock = threading.Lock()
+        waiting_on = {name: len(stage.after) for name, stage in self.stages.items()}
+        journal = task_queue.journal
+        saved = journal.load_checkpoints(key) if journal else {}
+        if saved:
+            logging.info(f"Restoring checkpointed stages {sorted(saved)} of {key}")
+
+        def submit(stage: GraphStage):
+            with lock:
+                run.timings[stage.name] = {'submitted': time.monotonic() - run.started,
+                                           'checkpointed': stage.name in saved}
+            if stage.name in saved:
+                complete(stage, saved[stage.name])
+                return
+            inputs = tuple(run.outputs[dep] for dep in stage.after) if stage.after else args
+            name = f"{key}.{stage.name}"
+            task = Task(name, stage.func, args=inputs, idempotency_key=name, **stage.task_options)
+            try:
+                task_future = task_queue.submit(task, priority)
+            except Exception as e:
+                fail(stage, e)
+                return
+            task_future.add_done_callback(lambda done: finished(stage, done))
+
+        def fail(stage: GraphStage, error: BaseException):
+            with lock:
+                if future.done():
+                    return
+                future.set_exception(error)
+            logging.error(f"Stage {stage.name} of {key} failed: {str(error)}")
+
+        def finished(stage: GraphStage, task_future: Future):
+            if task_future.cancelled() or task_future.exception() is not None:
+                fail(stage, task_future.exception() if not task_future.cancelled()
+                     else RuntimeError(f"Stage {stage.name} of {key} was cancelled"))
+                return
+            output = task_future.result()
+            if journal:
+                journal.save_checkpoint(key, stage.name, output)
+            complete(stage, output)
+
+        def complete(stage: GraphStage, output: Any):
+            ready = []
+            with lock:
+                if future.done():
+                    return
+                timing = run.timings[stage.name]
+                timing['finished'] = time.monotonic() - run.started
+                timing['duration'] = timing['finished'] - timing['submitted']
+                run.outputs[stage.name] = output
+                for child in self.dependents[stage.name]:
+                    waiting_on[child] -= 1
+                    if waiting_on[child] == 0:
+                        ready.append(self.stages[child])
+                done = len(run.outputs) == len(self.stages)
+                if done:
+                    self._mark_critical_path(run)
+            # Submit outside the lock: an inline or coalesced task completes inside submit
+            for child in ready:
+                submit(child)
+            if done:
+                if journal:
+                    journal.clear_checkpoints(key)
+                if task_queue.tracer is not None:
+                    self._trace(task_queue.tracer, run)
+                future.set_result(run)
+
+        for stage in list(self.stages.values()):
+            if not stage.after:
+                submit(stage)
+        return future
+
+    def _trace(self, tracer, run: GraphRun):
+        """Record the run and its stages as async spans, flagging the stages on the critical path."""
+        root = tracer.record(run.key, run.started, run.started + run.wall_time, 'stage_graph',
+                             on_thread=False, critical_path=' -> '.join(run.critical_path))
+        for name, timing in run.timings.items():
+            tracer.record(name, run.started + timing['submitted'], run.started + timing['finished'],
+                          'stage_graph', root, on_thread=False, critical=timing['critical'])
+
+    def _mark_critical_path(self, run: GraphRun):
+        """Fill in ``wall_time``, ``critical_path`` and each timing's ``critical`` flag."""
+        last = max(run.timings, key=lambda name: run.timings[name]['finished'])
+        run.wall_time = run.timings[last]['finished']
+        path = [last]
+        while self.stages[path[-1]].after:
+            path.append(max(self.stages[path[-1]].after, key=lambda dep: run.timings[dep]['finished']))
+        run.critical_path = path[::-1]
+        for name, timing in run.timings.items():
+            timing['critical'] = name in run.critical_path
@@ -3,25 +3,73 @@
 Task queue system for EchoLoop automation
 """
 
-import queue
 import threading
 import time
 import logging
 from datetime import datetime
-from typing import Dict, Any, Callable, List, Optional
+from typing import Dict, Any, Callable, Iterable, List, Optional
 import traceback
+import pickle
+import itertools
+from collections import OrderedDict, deque
+from pathlib import Path
+from concurrent.futures import Future, CancelledError
+
+from core.scheduler import IndexedHeap
+from core.timer import DeadlineTimer, retry_delay
+from core.archive import TaskArchive
+from core.executors import EXECUTORS, ProcessBackend, check_picklable
+from core.journal import TaskJournal
+from core.cancellation import CancelToken, TaskTimeoutError, set_current_token
+from core.resources import Resource
+from core.tracing import Tracer, current_span, set_current_span
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+WAIT_SAMPLES = 1000  # most recent queue waits kept per priority class for percentiles
+DEFAULT_ARCHIVE_PATH = Path(__file__).parent.parent / 'logs' / 'task_archive.jsonl'
 
 class Task:
-    """Represents a task in the queue."""
+    """Represents a task in the queue.
+    
+    ``executor`` is 'thread', 'process' or 'inline' (see core.executors).
+    ``timeout`` bounds each attempt; the watchdog then cancels its
+    CancelToken and retries the task if ``retry_on_timeout``.
+    ``resources`` are names of queue resources the task holds while it
+    runs; it is parked, not run, while one is exhausted.
+    ``idempotency_key``: adding a task whose key a live or recently
+    completed task owns returns that task instead.
+    ``affinity``: tasks sharing the key always run on one dedicated worker.
+    """
     
     def __init__(self, task_id: str, func: Callable, args: tuple = (), kwargs: dict = None, 
-                 max_retries: int = 3, retry_delay: int = 5, priority: int = 0):
+                 max_retries: int = 3, retry_delay: int = 5, priority: int = 0,
+                 backoff: float = 2.0, max_retry_delay: float = 300, jitter: float = 0.1,
+                 executor: str = 'thread', timeout: Optional[float] = None,
+                 retry_on_timeout: bool = True, resources: Optional[List[str]] = None,
+                 idempotency_key: Optional[str] = None, affinity: Optional[str] = None):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}, expected one of {EXECUTORS}")
+        if affinity is not None and executor != 'thread':
+            raise ValueError(f"Task {task_id}: affinity requires executor='thread'")
         self.task_id = task_id
         self.func = func
         self.args = args
         self.kwargs = kwargs or {}
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.backoff = backoff
+        self.max_retry_delay = max_retry_delay
+        self.jitter = jitter
+        self.executor = executor
+        self.timeout = timeout
+        self.retry_on_timeout = retry_on_timeout
+        self.resources = list(dict.fromkeys(resources or ()))  # names of Resources an attempt needs
+        self.held = []  # Resources held by the current attempt
+        self.idempotency_key = idempotency_key  # tasks with the same key are run once
+        self.affinity = affinity  # e.g. 'browser:0'; such tasks all run on one dedicated worker
+        self.cancel_token = None  # CancelToken of the current attempt
+        self.worker = None  # thread running the current attempt
+        self.span = None  # tracing Span from enqueue to final state, if the queue has a tracer
         self.priority = priority
         self.attempts = 0
         self.status = 'pending'
@@ -30,145 +78,854 @@ class Task:
         self.created_at = datetime.now()
         self.started_at = None
         self.completed_at = None
+        self.ready_since = None  # monotonic time the task last entered the ready heap
+        self.future = Future()  # resolved when the task reaches a final state
+    
+    def next_retry_delay(self) -> float:
+        """Backoff delay before the next attempt, based on attempts so far."""
+        return retry_delay(self.retry_delay, self.attempts, self.backoff,
+                           self.max_retry_delay, self.jitter)
+
+class AffinityLane:
+    """Ready heap and dedicated worker for the tasks sharing one affinity key."""
+    
+    def __init__(self, key: str, lock: threading.Lock):
+        self.key = key
+        self.ready = IndexedHeap()
+        self.not_empty = threading.Condition(lock)
+        self.worker = None
 
 class TaskQueue:
-    """Thread-safe task queue with retry mechanism."""
+    """Thread-safe priority task queue with retries, resources and affinity lanes.
+    
+    Ready tasks wait in an indexed heap (priority, then FIFO) and failed
+    tasks wait for their retry on a timer thread rather than on a worker.
+    Status changes go through ``_set_status``, so ``get_queue_stats`` is
+    O(1) and lock-free.
+    """
     
-    def __init__(self, max_workers: int = 4):
+    def __init__(self, max_workers: int = 4, max_finished_tasks: Optional[int] = None,
+                 max_task_age: Optional[float] = None, archive_path=None,
+                 process_workers: Optional[int] = None, journal: Optional[TaskJournal] = None,
+                 resources: Optional[Dict[str, Dict[str, Any]]] = None,
+                 min_workers: Optional[int] = None, scale_up_wait: float = 1.0,
+                 scale_up_depth: int = 4, idle_timeout: float = 30.0, scale_interval: float = 0.5,
+                 idempotency_ttl: float = 300.0, aging_interval: Optional[float] = None,
+                 tracer: Optional[Tracer] = None):
+        """
+        ``max_finished_tasks`` / ``max_task_age`` (seconds): evict the oldest
+        finished tasks to the archive at ``archive_path``, which
+        ``get_task_status`` falls back to.
+        ``process_workers``: size of the pool 'process' tasks run on.
+        ``journal``: a core.journal.TaskJournal recording every transition,
+        so ``recover()`` can resume unfinished work after a crash.
+        ``resources``: name -> ``add_resource`` options.
+        ``min_workers``: autoscale between this and ``max_workers``, adding a
+        worker when the ready heap holds ``scale_up_depth`` tasks or its head
+        has waited ``scale_up_wait`` seconds, and retiring one after
+        ``idle_timeout`` idle seconds.
+        ``idempotency_ttl``: how long a completed task's idempotency key
+        keeps coalescing duplicates.
+        ``aging_interval``: a waiting task gains one priority level per this
+        many seconds, so no priority class starves.
+        ``tracer``: a core.tracing.Tracer given a span per task and attempt.
+        """
+        if min_workers is not None and not 0 < min_workers <= max_workers:
+            raise ValueError(f"min_workers must be between 1 and max_workers ({max_workers})")
         self.max_workers = max_workers
-        self.queue = queue.PriorityQueue()
+        self.min_workers = min_workers if min_workers is not None else max_workers
+        self.autoscale = self.min_workers < max_workers
+        self.scale_up_wait = scale_up_wait
+        self.scale_up_depth = scale_up_depth
+        self.idle_timeout = idle_timeout
+        self.scale_interval = scale_interval
+        self.idle_workers = 0
+        self.scale_events = deque(maxlen=50)  # most recent scaling decisions
+        self.ready = IndexedHeap()  # task_id -> Task, keyed by priority
         self.workers = []
         self.tasks = {}  # task_id -> Task
         self.running = False
         self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.lanes: Dict[str, AffinityLane] = {}  # affinity key -> its lane
+        self.timer = DeadlineTimer(name="TaskRetryTimer")
+        self.retry_timers = {}  # task_id -> TimerHandle for tasks awaiting retry
+        self.process_backend = ProcessBackend(process_workers)
+        self.journal = journal
+        self.status_counts = {status: 0 for status in ('pending', 'running', 'completed', 'failed', 'cancelled')}
+        self.totals = {'runtime': 0.0, 'queue_wait': 0.0, 'retries': 0, 'dispatched': 0, 'executed': 0,
+                       'timeouts': 0, 'replaced_workers': 0, 'scaled_up': 0, 'scaled_down': 0, 'coalesced': 0}
+        self.worker_ids = itertools.count()
+        self.abandoned_workers = set()  # workers stuck in a timed-out attempt
+        self.stuck_resources = {}  # thread -> Resources its timed-out attempt still holds
+        self.resources: Dict[str, Resource] = {}
+        self.parked = {}  # task_id -> Resource the task is waiting for
+        for name, limits in (resources or {}).items():
+            self.add_resource(name, **limits)
+        self.idempotency_ttl = idempotency_ttl
+        self.aging_interval = aging_interval
+        self.tracer = tracer
+        self.wait_samples: Dict[int, deque] = {}  # priority -> recent queue waits in seconds
+        self.idempotent = {}  # idempotency key -> Task that owns it
+        self.idempotent_expiry = OrderedDict()  # key -> expiry of completed owners, soonest first
+        self.max_finished_tasks = max_finished_tasks
+        self.max_task_age = max_task_age
+        self.finished = OrderedDict()  # task_id -> monotonic finish time, oldest first
+        self.archive = None
+        if max_finished_tasks is not None or max_task_age is not None:
+            self.archive = TaskArchive(archive_path or DEFAULT_ARCHIVE_PATH)
         
     def start(self):
         """Start the worker threads."""
         self.running = True
-        for i in range(self.max_workers):
-            worker = threading.Thread(target=self._worker_loop, name=f"TaskWorker-{i}")
-            worker.daemon = True
-            worker.start()
-            self.workers.append(worker)
-        logging.info(f"Started {self.max_workers} task workers")
+        self.timer.start()
+        with self.lock:
+            for _ in range(self.min_workers):
+                self._start_worker()
+            for lane in self.lanes.values():
+                self._start_worker(lane)
+        if self.autoscale:
+            self.timer.call_later(self.scale_interval, self._autoscale_tick)
+            logging.info(f"Started {self.min_workers} task workers (autoscaling up to {self.max_workers})")
+        else:
+            logging.info(f"Started {self.max_workers} task workers")
     
     def stop(self):
-        """Stop all worker threads."""
-        self.running = False
-        # Put sentinel values to wake up workers
-        for _ in self.workers:
-            self.queue.put((float('inf'), None))
+        """Stop all worker threads.
+        
+        Tasks waiting for a retry or for a resource refill would be woken by
+        the timer, which stops here, so they are cancelled instead.
+        """
+        with self.lock:
+            self.running = False
+            # Wake up idle workers so they notice the shutdown
+            self.not_empty.notify_all()
+            for lane in self.lanes.values():
+                lane.not_empty.notify_all()
+            stranded = [self.tasks[task_id] for task_id in self.retry_timers]
+            self.retry_timers.clear()
+            for task_id, resource in self.parked.items():
+                del resource.waiting[task_id]
+                stranded.append(self.tasks[task_id])
+            self.parked.clear()
+            for task in stranded:
+                self._set_status(task, 'cancelled')
+                task.completed_at = datetime.now()
+            evicted = self._collect_evictions()
+        self.timer.stop()
+        self._archive(evicted)
+        for task in stranded:
+            task.future.set_exception(CancelledError(f"Task {task.task_id} was cancelled by stop()"))
+        self.process_backend.shutdown()
         
         # Wait for workers to finish
-        for worker in self.workers:
+        for worker in list(self.workers) + [lane.worker for lane in self.lanes.values() if lane.worker]:
             worker.join(timeout=5)
         
+        if self.journal:
+            self.journal.flush(timeout=5)
+        
         logging.info("Stopped all task workers")
     
+    def add_resource(self, name: str, rate: Optional[float] = None, burst: Optional[float] = None,
+                     max_concurrency: Optional[int] = None):
+        """Define a resource tasks can declare.
+        
+        ``rate`` is in task starts per second with bursts of up to ``burst``;
+        ``max_concurrency`` caps how many tasks hold it at once.
+        """
+        with self.lock:
+            if name in self.resources:
+                raise ValueError(f"Resource {name} is already defined")
+            self.resources[name] = Resource(name, rate, burst, max_concurrency)
+        logging.info(f"Added resource {name} (rate {rate}/s, max concurrency {max_concurrency})")
+    
     def add_task(self, task: Task, priority: int = 0) -> str:
-        """Add a task to the queue."""
-        task.priority = priority
+        """Add a task to the queue.
+        
+        Returns the task id, or the id of the existing task it was coalesced
+        into if its idempotency key is already taken.
+        """
+        return self._add_task(task, priority).task_id
+    
+    def _add_task(self, task: Task, priority: int) -> Task:
+        """Add a task, returning it or the existing task owning its idempotency key."""
+        return self._add_tasks([task], priority)[0]
+    
+    def add_tasks(self, tasks: Iterable[Task], priority: Optional[int] = None) -> List[str]:
+        """Add a batch of tasks under a single lock acquisition.
+        
+        The whole batch is validated first, so either every task is added or
+        none is. ``priority`` overrides each task's own priority when given.
+        Returns the task ids in order (coalesced tasks map to the existing id).
+        """
+        return [task.task_id for task in self._add_tasks(list(tasks), priority)]
+    
+    def submit_tasks(self, tasks: Iterable[Task], priority: Optional[int] = None) -> List[Future]:
+        """Batch version of ``submit``; returns one future per task, in order."""
+        return [task.future for task in self._add_tasks(list(tasks), priority)]
+    
+    def _add_tasks(self, tasks: List[Task], priority: Optional[int]) -> List[Task]:
+        """Add tasks, returning each one or the existing task owning its idempotency key."""
+        seen = set()
+        for task in tasks:
+            if task.task_id in seen:
+                raise ValueError(f"Task {task.task_id} appears twice in the batch")
+            seen.add(task.task_id)
+            if task.executor == 'process':
+                check_picklable(task.func, task.args, task.kwargs)
+            unknown = [name for name in task.resources if name not in self.resources]
+            if unknown:
+                raise ValueError(f"Task {task.task_id} needs undefined resources {unknown}")
+        
+        added = []  # canonical task for each input task
+        run_inline = []
+        coalesced = 0
+        parent_span = current_span() if self.tracer else None
+        with self.lock:
+            self._expire_idempotency_keys()
+            for task in tasks:
+                if task.idempotency_key is not None and task.idempotency_key in self.idempotent:
+                    continue  # coalesced below, even when it reuses the owner's id
+                previous = self.tasks.get(task.task_id)
+                if previous is not None and previous.status in ('pending', 'running'):
+                    raise ValueError(f"Task {task.task_id} is already queued")
+            
+            now = time.monotonic()
+            ready = []
+            for task in tasks:
+                key = task.idempotency_key
+                existing = self.idempotent.get(key) if key is not None else None
+                if existing is not None:
+                    coalesced += 1
+                    logging.info(f"Coalesced task {task.task_id} into {existing.task_id} (key {key!r})")
+                    added.append(existing)
+                    continue
+                if priority is not None:
+                    task.priority = priority
+                previous = self.tasks.get(task.task_id)
+                if previous is not None:
+                    self.status_counts[previous.status] -= 1
+                    self.finished.pop(task.task_id, None)
+                self.tasks[task.task_id] = task
+                self.status_counts[task.status] += 1
+                if key is not None:
+                    self.idempotent[key] = task
+                if self.journal:
+                    self.journal.record_enqueue(task, task.priority)
+                if self.tracer:
+                    task.span = self.tracer.start_span(task.task_id, 'task', parent_span, on_thread=False,
+                                                       start=now, priority=task.priority,
+                                                       executor=task.executor)
+                if task.executor == 'inline' and self._acquire_resources(task) is None:
+                    run_inline.append(task)
+                elif task.affinity is not None:
+                    self._push_ready(task)
+                else:
+                    # Inline tasks whose resources are busy wait on the heap like any other
+                    task.ready_since = now
+                    ready.append((task.task_id, task, self._heap_key(task)))
+                added.append(task)
+            
+            self.totals['coalesced'] += coalesced
+            if ready:
+                # Lower priority number = higher priority
+                self.ready.push_many(ready)
+                self.not_empty.notify(len(ready))
+                if self.autoscale and len(self.ready) >= self.scale_up_depth:
+                    self._maybe_scale_up()
+        
+        if len(tasks) == 1:
+            if not coalesced:
+                logging.info(f"Added task {tasks[0].task_id} with priority {tasks[0].priority}")
+        else:
+            logging.info(f"Added {len(tasks) - coalesced} tasks ({coalesced} coalesced)")
+        for task in run_inline:
+            task.future.set_running_or_notify_cancel()
+            self._execute_task(task)
+        return added
+    
+    def submit(self, task: Task, priority: int = 0) -> Future:
+        """Add a task and return a Future for its result.
+        
+        The future is a standard ``concurrent.futures.Future`` so it works with
+        ``result(timeout)``, ``add_done_callback`` and the module-level
+        ``wait`` / ``as_completed`` helpers. A permanently failed task raises
+        its last error from ``result()``; a cancelled one raises CancelledError.
+        If the task was coalesced, the existing task's future is returned.
+        """
+        return self._add_task(task, priority).future
+    
+    def recover(self, resolver: Optional[Callable[[Dict[str, Any]], Optional[Task]]] = None) -> List[str]:
+        """Re-enqueue tasks the journal recorded as unfinished in a previous run.
+        
+        Tasks whose function and arguments were picklable are rebuilt from the
+        journal. For the rest ``resolver`` is called with the journal row
+        (task_id, func, priority, attempts) and may return a replacement Task.
+        Tasks that cannot be rebuilt are marked abandoned. Returns the ids of
+        the re-enqueued tasks.
+        """
+        if not self.journal:
+            return []
+        recovered = []
+        for row in self.journal.unfinished():
+            task = None
+            if row['payload'] is not None:
+                try:
+                    func, args, kwargs, max_retries, retry_delay = pickle.loads(row['payload'])
+                    task = Task(row['task_id'], func, args, kwargs, max_retries, retry_delay)
+                except Exception as e:
+                    logging.error(f"Could not restore task {row['task_id']} from journal: {str(e)}")
+            if task is None and resolver:
+                task = resolver(row)
+            if task is None:
+                self.journal.mark_abandoned(row['task_id'])
+                logging.warning(f"Abandoned unfinished task {row['task_id']} ({row['func']}) from previous run")
+                continue
+            self.add_task(task, row['priority'])
+            recovered.append(task.task_id)
+        
+        logging.info(f"Recovered {len(recovered)} unfinished tasks from journal")
+        return recovered
+    
+    def cancel(self, task_id: str) -> bool:
+        """Cancel a task.
+        
+        Queued and retry-pending tasks are cancelled immediately. For a running
+        task the attempt's CancelToken is cancelled and the task is marked
+        cancelled once the function returns. Returns False for unknown or
+        finished tasks.
+        """
         with self.lock:
-            self.tasks[task.task_id] = task
-            # Lower priority number = higher priority
-            self.queue.put((priority, task))
+            task = self.tasks.get(task_id)
+            if task is not None and task.status == 'running':
+                task.cancel_token.cancel('cancelled')
+                logging.info(f"Requested cancellation of running task {task_id}")
+                return True
+            heap = self._ready_heap(task) if task is not None else self.ready
+            if task_id in heap:
+                task = heap.remove(task_id)
+            elif task_id in self.parked:
+                del self.parked.pop(task_id).waiting[task_id]
+                task = self.tasks[task_id]
+            elif task_id in self.retry_timers:
+                self.timer.cancel(self.retry_timers.pop(task_id))
+                task = self.tasks[task_id]
+            else:
+                return False
+            self._set_status(task, 'cancelled')
+            task.completed_at = datetime.now()
+            evicted = self._collect_evictions()
         
-        logging.info(f"Added task {task.task_id} with priority {priority}")
-        return task.task_id
+        self._archive(evicted)
+        if not task.future.cancel():
+            # Already started on an earlier attempt
+            task.future.set_exception(CancelledError(f"Task {task_id} was cancelled"))
+        logging.info(f"Cancelled task {task_id}")
+        return True
+    
+    def reprioritize(self, task_id: str, priority: int) -> bool:
+        """Change the priority of a queued task. Returns False if it is not waiting to run."""
+        with self.lock:
+            if task_id in self.parked:
+                # Takes effect when the task goes back on the heap
+                self.tasks[task_id].priority = priority
+                logging.info(f"Reprioritized task {task_id} to {priority}")
+                return True
+            task = self.tasks.get(task_id)
+            heap = self._ready_heap(task) if task is not None else self.ready
+            if task_id not in heap:
+                return False
+            task.priority = priority
+            heap.update(task_id, self._heap_key(task))
+        
+        logging.info(f"Reprioritized task {task_id} to {priority}")
+        return True
     
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
-        """Get the status of a task."""
+        """Get the status of a task, falling back to the archive for evicted tasks."""
         with self.lock:
-            if task_id not in self.tasks:
-                return {'status': 'not_found'}
-            
-            task = self.tasks[task_id]
-            return {
-                'status': task.status,
-                'attempts': task.attempts,
-                'max_retries': task.max_retries,
-                'created_at': task.created_at,
-                'started_at': task.started_at,
-                'completed_at': task.completed_at,
-                'result': task.result,
-                'error': str(task.error) if task.error else None
-            }
+            task = self.tasks.get(task_id)
+            if task is not None:
+                return self._status_dict(task)
+        
+        record = self.archive.get(task_id) if self.archive else None
+        if record is None:
+            return {'status': 'not_found'}
+        record.pop('task_id', None)
+        for key in ('created_at', 'started_at', 'completed_at'):
+            if record.get(key):
+                record[key] = datetime.fromisoformat(record[key])
+        return record
+    
+    def _status_dict(self, task: Task) -> Dict[str, Any]:
+        return {
+            'status': task.status,
+            'attempts': task.attempts,
+            'max_retries': task.max_retries,
+            'created_at': task.created_at,
+            'started_at': task.started_at,
+            'completed_at': task.completed_at,
+            'result': task.result,
+            'error': str(task.error) if task.error else None
+        }
     
     def get_queue_stats(self) -> Dict[str, Any]:
-        """Get queue statistics."""
+        """Get queue statistics from the incrementally maintained counters."""
+        counts = dict(self.status_counts)
+        totals = dict(self.totals)
+        return {
+            'queue_size': len(self.ready) + sum(len(lane.ready) for lane in list(self.lanes.values())),
+            'blocked': len(self.parked),
+            **counts,
+            'total_tasks': len(self.tasks) + (len(self.archive) if self.archive else 0),
+            'archived': len(self.archive) if self.archive else 0,
+            'retries': totals['retries'],
+            'total_runtime': totals['runtime'],
+            'avg_runtime': totals['runtime'] / totals['executed'] if totals['executed'] else 0.0,
+            'total_queue_wait': totals['queue_wait'],
+            'avg_queue_wait': totals['queue_wait'] / totals['dispatched'] if totals['dispatched'] else 0.0,
+            'timeouts': totals['timeouts'],
+            'workers': len(self.workers),
+            'idle_workers': self.idle_workers,
+            'min_workers': self.min_workers,
+            'max_workers': self.max_workers,
+            'replaced_workers': totals['replaced_workers'],
+            'scaled_up': totals['scaled_up'],
+            'scaled_down': totals['scaled_down'],
+            'scale_events': list(self.scale_events),
+            'coalesced': totals['coalesced'],
+            'affinity': {key: {'queue_size': len(lane.ready),
+                               'worker': lane.worker.name if lane.worker else None}
+                         for key, lane in list(self.lanes.items())},
+            'wait_percentiles': {priority: wait_percentiles(samples)
+                                 for priority, samples in list(self.wait_samples.items())},
+            'resources': {name: resource.stats() for name, resource in list(self.resources.items())}
+        }
+    
+    def _set_status(self, task: Task, status: str):
+        """Move a task to a new status. Must be called with the lock held."""
+        self.status_counts[task.status] -= 1
+        self.status_counts[status] += 1
+        task.status = status
+        if status in FINISHED_STATUSES:
+            self.finished[task.task_id] = time.monotonic()
+            if task.span is not None:
+                self.tracer.finish_span(task.span, status=status, attempts=task.attempts)
+            key = task.idempotency_key
+            if key is not None and self.idempotent.get(key) is task:
+                if status == 'completed':
+                    # Keep serving the result to duplicates for a while
+                    self.idempotent_expiry[key] = time.monotonic() + self.idempotency_ttl
+                else:
+                    del self.idempotent[key]
+        if self.journal:
+            if status == 'running':
+                self.journal.record_start(task.task_id, task.attempts)
+            elif status in FINISHED_STATUSES:
+                error = str(task.error) if status == 'failed' and task.error else None
+                self.journal.record_finish(task.task_id, status, task.attempts, error)
+    
+    def _expire_idempotency_keys(self):
+        """Forget completed tasks whose TTL is over. Must be called with the lock held."""
+        now = time.monotonic()
+        while self.idempotent_expiry:
+            key, expires_at = next(iter(self.idempotent_expiry.items()))
+            if expires_at > now:
+                break
+            del self.idempotent_expiry[key]
+            del self.idempotent[key]
+    
+    def _collect_evictions(self) -> List[Dict[str, Any]]:
+        """Drop finished tasks beyond the retention limits. Must be called with the lock held.
+        
+        Returns their status records for ``_archive``, which should be called
+        after the lock is released.
+        """
+        if self.archive is None:
+            return []
+        evicted = []
+        now = time.monotonic()
+        while self.finished:
+            task_id, finished_at = next(iter(self.finished.items()))
+            over_count = self.max_finished_tasks is not None and len(self.finished) > self.max_finished_tasks
+            over_age = self.max_task_age is not None and now - finished_at > self.max_task_age
+            if not (over_count or over_age):
+                break
+            del self.finished[task_id]
+            task = self.tasks.pop(task_id)
+            evicted.append({'task_id': task_id, **self._status_dict(task)})
+        return evicted
+    
+    def _archive(self, records: List[Dict[str, Any]]):
+        """Write evicted task records to the archive."""
+        if records:
+            try:
+                self.archive.append(records)
+            except OSError as e:
+                logging.error(f"Error archiving {len(records)} tasks: {str(e)}")
+    
+    def _heap_key(self, task: Task) -> float:
+        """Ready-heap key of a task: its priority, aged by time spent waiting if enabled."""
+        if self.aging_interval is None:
+            return task.priority
+        return task.priority + task.ready_since / self.aging_interval
+    
+    def _push_ready(self, task: Task):
+        """Put a task on the ready heap. Must be called with the lock held."""
+        task.ready_since = time.monotonic()
+        self._enqueue_ready(task)
+    
+    def _enqueue_ready(self, task: Task):
+        """Push a task onto its shared or affinity heap and wake a worker. Must be called with the lock held."""
+        if task.affinity is not None:
+            lane = self._lane(task.affinity)
+            lane.ready.push(task.task_id, task, self._heap_key(task))
+            lane.not_empty.notify()
+            return
+        # Lower priority number = higher priority
+        self.ready.push(task.task_id, task, self._heap_key(task))
+        self.not_empty.notify()
+        if self.autoscale and len(self.ready) >= self.scale_up_depth:
+            self._maybe_scale_up()
+    
+    def _ready_heap(self, task: Task) -> IndexedHeap:
+        """The heap a task waits in when ready. Must be called with the lock held."""
+        if task.affinity is None:
+            return self.ready
+        return self._lane(task.affinity).ready
+    
+    def _lane(self, key: str) -> AffinityLane:
+        """Get or create the lane of an affinity key. Must be called with the lock held."""
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = AffinityLane(key, self.lock)
+            if self.running:
+                self._start_worker(lane)
+        return lane
+    
+    def _start_worker(self, lane: Optional[AffinityLane] = None):
+        """Start a shared-pool worker, or the dedicated worker of lane. Must be called with the lock held."""
+        if lane is None:
+            worker = threading.Thread(target=self._worker_loop, name=f"TaskWorker-{next(self.worker_ids)}")
+            self.workers.append(worker)
+        else:
+            worker = threading.Thread(target=self._worker_loop, args=(lane,), name=f"TaskWorker-{lane.key}")
+            lane.worker = worker
+        worker.daemon = True
+        worker.start()
+    
+    def _maybe_scale_up(self):
+        """Add a worker if the backlog calls for one. Must be called with the lock held."""
+        if not self.running or self.idle_workers or len(self.workers) >= self.max_workers or not self.ready:
+            return
+        depth = len(self.ready)
+        _, head = self.ready.peek()
+        waited = time.monotonic() - head.ready_since
+        if depth < self.scale_up_depth and waited < self.scale_up_wait:
+            return
+        self._start_worker()
+        self.totals['scaled_up'] += 1
+        self._record_scale_event('up', f"queue depth {depth}, head waited {waited:.2f}s")
+    
+    def _record_scale_event(self, action: str, reason: str):
+        """Must be called with the lock held."""
+        self.scale_events.append({'at': datetime.now(), 'action': action,
+                                  'workers': len(self.workers), 'reason': reason})
+        logging.info(f"Scaled task workers {action} to {len(self.workers)} ({reason})")
+    
+    def _autoscale_tick(self):
+        """Timer callback: scale up for tasks that have waited too long, then reschedule."""
         with self.lock:
-            pending = sum(1 for task in self.tasks.values() if task.status == 'pending')
-            running = sum(1 for task in self.tasks.values() if task.status == 'running')
-            completed = sum(1 for task in self.tasks.values() if task.status == 'completed')
-            failed = sum(1 for task in self.tasks.values() if task.status == 'failed')
-            
-            return {
-                'queue_size': self.queue.qsize(),
-                'pending': pending,
-                'running': running,
-                'completed': completed,
-                'failed': failed,
-                'total_tasks': len(self.tasks)
-            }
-    
-    def _worker_loop(self):
-        """Worker loop that processes tasks from the queue."""
-        while self.running:
+            if not self.running:
+                return
+            self._maybe_scale_up()
+        self.timer.call_later(self.scale_interval, self._autoscale_tick)
+    
+    def _worker_loop(self, lane: Optional[AffinityLane] = None):
+        """Worker loop that processes tasks from the shared heap, or from lane's heap."""
+        me = threading.current_thread()
+        ready, not_empty = (self.ready, self.not_empty) if lane is None else (lane.ready, lane.not_empty)
+        idle_since = time.monotonic()
+        while self.running and me not in self.abandoned_workers:
             try:
                 # Get task from queue (blocking with timeout)
-                try:
-                    priority, task = self.queue.get(timeout=1)
-                    if task is None:  # Sentinel value
-                        break
-                except queue.Empty:
+                with self.lock:
+                    if not ready:
+                        if (lane is None and self.autoscale and len(self.workers) > self.min_workers
+                                and time.monotonic() - idle_since >= self.idle_timeout):
+                            # Idle long enough; retire this worker
+                            self.workers.remove(me)
+                            self.totals['scaled_down'] += 1
+                            self._record_scale_event('down', f"idle for {self.idle_timeout:.0f}s")
+                            return
+                        if lane is not None:
+                            not_empty.wait(timeout=1)
+                            continue
+                        self.idle_workers += 1
+                        not_empty.wait(timeout=min(1, self.idle_timeout))
+                        self.idle_workers -= 1
+                        continue
+                    task_id, task = ready.pop()
+                    blocking = self._acquire_resources(task)
+                    if blocking is not None:
+                        self._park(task, blocking)
+                        continue
+                    waited = time.monotonic() - task.ready_since
+                    self.totals['queue_wait'] += waited
+                    samples = self.wait_samples.get(task.priority)
+                    if samples is None:
+                        samples = self.wait_samples[task.priority] = deque(maxlen=WAIT_SAMPLES)
+                    samples.append(waited)
+                    self.totals['dispatched'] += 1
+                    if task.span is not None:
+                        self.tracer.record('queue_wait', task.ready_since, task.ready_since + waited, 'task',
+                                           task.span, on_thread=False, attempt=task.attempts + 1)
+                
+                if task.attempts == 0 and not task.future.set_running_or_notify_cancel():
+                    with self.lock:
+                        self._release_resources(task)
+                        self._set_status(task, 'cancelled')
+                        task.completed_at = datetime.now()
+                        evicted = self._collect_evictions()
+                    self._archive(evicted)
                     continue
                 
                 # Execute the task
                 self._execute_task(task)
+                idle_since = time.monotonic()
                 
             except Exception as e:
                 logging.error(f"Worker error: {str(e)}\n{traceback.format_exc()}")
+        
+        with self.lock:
+            self.abandoned_workers.discard(me)
     
     def _execute_task(self, task: Task):
-        """Execute a single task with retry logic."""
-        task.attempts += 1
-        task.started_at = datetime.now()
-        task.status = 'running'
+        """Execute a single attempt of a task and record its outcome."""
+        with self.lock:
+            task.attempts += 1
+            attempt = task.attempts
+            task.started_at = datetime.now()
+            token = task.cancel_token = CancelToken()
+            task.worker = threading.current_thread()
+            self._set_status(task, 'running')
+            deadline = None
+            if task.timeout:
+                deadline = self.timer.call_later(task.timeout, self._on_timeout, task, attempt)
         
-        logging.info(f"Executing task {task.task_id} (attempt {task.attempts}/{task.max_retries})")
+        logging.info(f"Executing task {task.task_id} (attempt {attempt}/{task.max_retries})")
         
+        started = time.monotonic()
+        previous_token = set_current_token(token)
+        attempt_span = previous_span = None
+        if task.span is not None:
+            attempt_span = self.tracer.start_span(task.task_id, 'attempt', task.span, start=started,
+                                                  attempt=attempt, executor=task.executor)
+            previous_span = set_current_span(attempt_span)
+        error = None
         try:
-            # Execute the task function
-            result = task.func(*task.args, **task.kwargs)
-            
-            # Task completed successfully
-            task.result = result
-            task.status = 'completed'
-            task.completed_at = datetime.now()
-            
-            logging.info(f"Task {task.task_id} completed successfully")
-            
-        except Exception as e:
-            logging.error(f"Task {task.task_id} failed: {str(e)}")
-            task.error = e
-            
-            # Check if we should retry
-            if task.attempts < task.max_retries:
-                # Schedule retry
-                task.status = 'pending'
-                time.sleep(task.retry_delay)
-                
-                # Re-add to queue with same priority
-                self.queue.put((task.priority, task))
-                logging.info(f"Retrying task {task.task_id} in {task.retry_delay} seconds")
-                
+            # Execute the task function on its executor
+            if task.executor == 'process':
+                result = self.process_backend.run(task.func, task.args, task.kwargs)
             else:
-                # Max retries exceeded
-                task.status = 'failed'
+                result = task.func(*task.args, **task.kwargs)
+        except Exception as e:
+            result = None
+            error = e
+        finally:
+            set_current_token(previous_token)
+            if attempt_span is not None:
+                set_current_span(previous_span)
+            if deadline:
+                self.timer.cancel(deadline)
+        
+        with self.lock:
+            if task.attempts != attempt or task.status != 'running':
+                # The watchdog already timed this attempt out; drop its late outcome
+                self._release(self.stuck_resources.pop(threading.current_thread(), []))
+                logging.warning(f"Discarding late result of timed out task {task.task_id} (attempt {attempt})")
+                if attempt_span is not None:
+                    self.tracer.finish_span(attempt_span, outcome='timed_out')
+                return
+            self._release_resources(task)
+            self._record_runtime(started)
+            if token.reason == 'cancelled':
+                self._set_status(task, 'cancelled')
+                task.completed_at = datetime.now()
+                outcome = 'cancelled'
+            elif error is None:
+                task.result = result
+                self._set_status(task, 'completed')
                 task.completed_at = datetime.now()
-                logging.error(f"Task {task.task_id} failed permanently after {task.attempts} attempts")
+                outcome = 'completed'
+            else:
+                outcome, delay = self._record_failure(task, error)
+            if attempt_span is not None:
+                if error is not None:
+                    attempt_span.args['error'] = f"{type(error).__name__}: {error}"
+                self.tracer.finish_span(attempt_span, outcome=outcome)
+            evicted = self._collect_evictions()
+        self._archive(evicted)
+        
+        if outcome == 'completed':
+            task.future.set_result(result)
+            logging.info(f"Task {task.task_id} completed successfully")
+        elif outcome == 'cancelled':
+            task.future.set_exception(CancelledError(f"Task {task.task_id} was cancelled"))
+            logging.info(f"Cancelled task {task.task_id}")
+        else:
+            logging.error(f"Task {task.task_id} failed: {str(error)}")
+            self._log_failure(task, error, outcome, delay)
+    
+    def _record_failure(self, task: Task, error: Exception):
+        """Schedule a retry or fail the task for good. Must be called with the lock held.
+        
+        Returns ``('retry', delay)`` or ``('failed', None)``.
+        """
+        task.error = error
+        retry = task.attempts < task.max_retries
+        if isinstance(error, TaskTimeoutError) and not task.retry_on_timeout:
+            retry = False
+        if not retry:
+            # Max retries exceeded
+            self._set_status(task, 'failed')
+            task.completed_at = datetime.now()
+            return 'failed', None
+        
+        # Schedule retry without holding this worker
+        delay = task.next_retry_delay()
+        self._set_status(task, 'pending')
+        self.totals['retries'] += 1
+        self.retry_timers[task.task_id] = self.timer.call_later(delay, self._requeue, task)
+        if self.journal:
+            self.journal.record_retry(task.task_id, task.attempts, delay, str(error))
+        return 'retry', delay
+    
+    def _log_failure(self, task: Task, error: Exception, outcome: str, delay: Optional[float]):
+        """Log a failed attempt and resolve the future if it was the last one."""
+        if outcome == 'retry':
+            logging.info(f"Retrying task {task.task_id} in {delay:.1f} seconds")
+        else:
+            task.future.set_exception(error)
+            logging.error(f"Task {task.task_id} failed permanently after {task.attempts} attempts")
+    
+    def _on_timeout(self, task: Task, attempt: int):
+        """Watchdog timer callback for an attempt that passed its deadline.
+        
+        A shared worker stuck in the call is replaced. The task's resources,
+        and an affinity lane's one worker, stay held until the call returns.
+        """
+        with self.lock:
+            if task.attempts != attempt or task.status != 'running':
+                return  # finished in time
+            task.cancel_token.cancel('timeout')
+            # The hung call may still be using its resources (e.g. driving the
+            # browser), so they are only released once it returns
+            stuck = task.worker
+            held, task.held = task.held, []
+            if held:
+                self.stuck_resources[stuck] = held
+            self.totals['timeouts'] += 1
+            error = TaskTimeoutError(f"Task {task.task_id} timed out after {task.timeout}s (attempt {attempt})")
+            self._record_runtime(time.monotonic() - task.timeout)
+            outcome, delay = self._record_failure(task, error)
+            evicted = self._collect_evictions()
+            
+            # Replace a stuck shared worker so throughput recovers. A lane is
+            # left to its stuck worker: a second one would drive the lane's
+            # session while the hung call still does
+            if stuck in self.workers:
+                self.workers.remove(stuck)
+                self.abandoned_workers.add(stuck)
+                self.totals['replaced_workers'] += 1
+                if self.running:
+                    self._start_worker()
+        
+        self._archive(evicted)
+        logging.error(str(error))
+        self._log_failure(task, error, outcome, delay)
+    
+    def _record_runtime(self, started: float):
+        """Add one attempt's runtime to the totals. Must be called with the lock held."""
+        self.totals['runtime'] += time.monotonic() - started
+        self.totals['executed'] += 1
+    
+    def _acquire_resources(self, task: Task) -> Optional[Resource]:
+        """Take all of a task's resources, or none. Must be called with the lock held.
+        
+        Returns None on success, otherwise the first resource that is exhausted.
+        """
+        now = time.monotonic()
+        for name in task.resources:
+            resource = self.resources[name]
+            if not resource.available(now):
+                return resource
+        for name in task.resources:
+            resource = self.resources[name]
+            resource.acquire()
+            task.held.append(resource)
+            if resource.waiting:
+                self._schedule_refill(resource)
+        return None
+    
+    def _release_resources(self, task: Task):
+        """Give back the resources of a finished attempt. Must be called with the lock held."""
+        held, task.held = task.held, []
+        self._release(held)
+    
+    def _release(self, held: List[Resource]):
+        """Must be called with the lock held."""
+        now = time.monotonic()
+        for resource in held:
+            resource.release()
+            self._unpark(resource, resource.available(now))
+    
+    def _park(self, task: Task, resource: Resource):
+        """Set a ready task aside until resource frees up. Must be called with the lock held."""
+        resource.waiting[task.task_id] = task
+        self.parked[task.task_id] = resource
+        self._schedule_refill(resource)
+    
+    def _schedule_refill(self, resource: Resource):
+        """Wake parked tasks when the next token arrives. Must be called with the lock held."""
+        delay = resource.refill_delay()
+        if delay and resource.wakeup is None:
+            resource.wakeup = self.timer.call_later(delay, self._on_refill, resource)
+    
+    def _unpark(self, resource: Resource, count: int):
+        """Move up to count parked tasks back to the ready heap. Must be called with the lock held."""
+        while resource.waiting and count > 0:
+            task_id, task = resource.waiting.popitem(last=False)
+            del self.parked[task_id]
+            # Keep ready_since so queue wait includes the time spent parked
+            self._enqueue_ready(task)
+            count -= 1
+    
+    def _on_refill(self, resource: Resource):
+        """Timer callback: a rate-limited resource has a token again."""
+        with self.lock:
+            resource.wakeup = None
+            self._unpark(resource, max(resource.available(time.monotonic()), 1))
+    
+    def _requeue(self, task: Task):
+        """Timer callback: put a task back on the ready heap once its retry delay is over."""
+        with self.lock:
+            if self.retry_timers.pop(task.task_id, None) is None:
+                return  # cancelled meanwhile
+            # Re-add to queue with same priority
+            self._push_ready(task)
+
+def wait_percentiles(samples) -> Dict[str, Any]:
+    """p50/p95/p99/max (nearest rank) of a collection of wait times."""
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    def rank(pct):
+        return values[min(len(values) - 1, max(0, int(round(pct / 100 * len(values))) - 1))]
+    return {'count': len(values), 'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'max': values[-1]}
 
 def create_task(task_id: str, func: Callable, args: tuple = (), kwargs: dict = None,
-                max_retries: int = 3, retry_delay: int = 5) -> Task:
+                max_retries: int = 3, retry_delay: int = 5, **options) -> Task:
     """Convenience function to create a task."""
-    return Task(task_id, func, args, kwargs, max_retries, retry_delay) 
\ No newline at end of file
+    return Task(task_id, func, args, kwargs, max_retries, retry_delay, **options) 
\ No newline at end of file
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Deadline timer used to schedule delayed work such as task retries
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import traceback
+from typing import Callable
+
+class TimerHandle:
+    """Handle for a scheduled callback; pass it to DeadlineTimer.cancel()."""
+
+    __slots__ = ('deadline', 'func', 'args', 'cancelled')
+
+    def __init__(self, deadline: float, func: Callable, args: tuple):
+        self.deadline = deadline
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+class DeadlineTimer:
+    """Runs callbacks at their deadlines from a single background thread.
+
+    Deadlines are kept in a heap, so scheduling and cancelling are O(log n)
+    and the thread only wakes up when the earliest deadline is due.
+    Callbacks must be short; they run on the timer thread.
+    """
+
+    def __init__(self, name: str = "DeadlineTimer"):
+        self.name = name
+        self.heap = []  # (deadline, seq, TimerHandle)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """Start the timer thread."""
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop the timer thread, dropping callbacks that are not yet due."""
+        with self.cond:
+            self.running = False
+            self.heap.clear()
+            self.cond.notify()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        self.thread = None
+
+    def call_later(self, delay: float, func: Callable, *args) -> TimerHandle:
+        """Schedule func(*args) to run after delay seconds."""
+        handle = TimerHandle(time.monotonic() + max(delay, 0), func, args)
+        with self.cond:
+            heapq.heappush(self.heap, (handle.deadline, next(self.seq), handle))
+            # Only wake the thread if this is the new earliest deadline
+            if self.heap[0][2] is handle:
+                self.cond.notify()
+        return handle
+
+    def cancel(self, handle: TimerHandle):
+        """Cancel a scheduled callback. Cancelled entries are discarded lazily."""
+        handle.cancelled = True
+
+    def pending(self) -> int:
+        """Number of scheduled (possibly cancelled) callbacks."""
+        return len(self.heap)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+                    self.cond.wait(timeout=timeout)
+                if not self.running:
+                    return
+                _, _, handle = heapq.heappop(self.heap)
+
+            if handle.cancelled:
+                continue
+            try:
+                handle.func(*handle.args)
+            except Exception as e:
+                logging.error(f"Timer callback error: {str(e)}\n{traceback.format_exc()}")
+
+def retry_delay(base_delay: float, attempt: int, backoff: float = 2.0,
+                max_delay: float = 300, jitter: float = 0.1) -> float:
+    """Exponential backoff delay for the given retry attempt (1-based).
+
+    ``jitter`` is the fraction of the delay that is randomised in either
+    direction, so retries of tasks that failed together spread out.
+    """
+    delay = min(base_delay * (backoff ** max(attempt - 1, 0)), max_delay)
+    if jitter:
+        delay *= 1 + random.uniform(-jitter, jitter)
+    return max(delay, 0)
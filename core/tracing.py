@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Tracing spans for task queue work, exported as Chrome trace-event JSON
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+class Span:
+    """A timed piece of work with an optional parent span.
+
+    Spans with a ``tid`` ran on that thread. Spans without one (a task's
+    whole lifetime, its time in the ready heap) are not tied to a thread and
+    are exported as async events. ``end`` stays None until finished.
+    """
+
+    __slots__ = ('tracer', 'name', 'category', 'span_id', 'parent_id', 'tid', 'start', 'end', 'args')
+
+    def __init__(self, tracer: 'Tracer', name: str, category: str, span_id: int,
+                 parent_id: Optional[int], tid: Optional[int], start: float, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.tid = tid
+        self.start = start
+        self.end = None
+        self.args = args
+
+class Tracer:
+    """Collects spans in memory, keeping the most recent ``max_spans``.
+
+    Times are ``time.monotonic()`` values, the same clock TaskQueue uses, so
+    recorded intervals line up with queue bookkeeping. Spans are appended
+    when they start; ``export_chrome_trace`` writes every span, treating ones
+    still open as ending at export time. Safe to use from any thread.
+    """
+
+    def __init__(self, max_spans: int = 100000):
+        self.spans = deque(maxlen=max_spans)
+        self.ids = itertools.count(1)
+        self.origin = time.monotonic()
+        self.pid = os.getpid()
+        self.thread_names: Dict[int, str] = {}
+
+    def start_span(self, name: str, category: str = 'stage', parent: Optional[Span] = None,
+                   on_thread: bool = True, start: Optional[float] = None, **args) -> Span:
+        """Open a span; ``on_thread=False`` makes it an async span not tied to this thread."""
+        tid = None
+        if on_thread:
+            tid = threading.get_native_id()
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+        span = Span(self, name, category, next(self.ids), parent.span_id if parent else None, tid,
+                    time.monotonic() if start is None else start, args)
+        self.spans.append(span)
+        return span
+
+    def finish_span(self, span: Span, end: Optional[float] = None, **args):
+        span.args.update(args)
+        span.end = time.monotonic() if end is None else end
+
+    def record(self, name: str, start: float, end: float, category: str = 'stage',
+               parent: Optional[Span] = None, on_thread: bool = True, **args) -> Span:
+        """Add an already finished span."""
+        span = self.start_span(name, category, parent, on_thread, start, **args)
+        span.end = end
+        return span
+
+    @contextmanager
+    def span(self, name: str, category: str = 'stage', **args):
+        """Trace a block on this thread as a child of the current span."""
+        span = self.start_span(name, category, current_span(), **args)
+        previous = set_current_span(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.args['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            set_current_span(previous)
+            if span.end is None:
+                span.end = time.monotonic()
+
+    def clear(self):
+        self.spans.clear()
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Build a Chrome trace-event document (chrome://tracing, ui.perfetto.dev)."""
+        now = time.monotonic()
+        events: List[Dict[str, Any]] = [
+            {'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'EchoLoop'}},
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': 0, 'args': {'name': 'tasks'}}
+        ]
+        for tid, name in list(self.thread_names.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+
+        spans = list(self.spans)
+        async_categories = {span.span_id: span.category for span in spans if span.tid is None}
+        for span in spans:
+            end = span.end if span.end is not None else now
+            args = {'span_id': span.span_id, 'parent_id': span.parent_id, **span.args}
+            if span.end is None:
+                args['unfinished'] = True
+            ts = (span.start - self.origin) * 1e6
+            if span.tid is not None:
+                events.append({'name': span.name, 'cat': span.category, 'ph': 'X', 'ts': ts,
+                               'dur': (end - span.start) * 1e6, 'pid': self.pid, 'tid': span.tid,
+                               'args': args})
+            else:
+                # Nestable async events sharing the parent's id and category, so
+                # the viewer stacks a task's queue waits under the task
+                root = span.parent_id if span.parent_id in async_categories else span.span_id
+                common = {'name': span.name, 'cat': async_categories[root], 'id': root,
+                          'pid': self.pid, 'tid': 0}
+                events.append({**common, 'ph': 'b', 'ts': ts, 'args': args})
+                events.append({**common, 'ph': 'e', 'ts': (end - self.origin) * 1e6})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path) -> int:
+        """Write the trace to path as JSON and return the number of spans written."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        trace = self.to_chrome_trace()
+        tmp = path.with_suffix(path.suffix + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(trace, f, default=str)
+        os.replace(tmp, path)
+        return sum(1 for event in trace['traceEvents'] if event['ph'] in ('X', 'b'))
+
+_local = threading.local()
+
+def current_span() -> Optional[Span]:
+    """Innermost span open on this thread, if any."""
+    return getattr(_local, 'span', None)
+
+def set_current_span(span: Optional[Span]) -> Optional[Span]:
+    """Install span as this thread's current span and return the previous one."""
+    previous = getattr(_local, 'span', None)
+    _local.span = span
+    return previous
+
+@contextmanager
+def span(name: str, category: str = 'stage', **args):
+    """Trace a block as a child of this thread's current span.
+
+    Task functions use this for their stages; it does nothing unless the
+    task runs on a TaskQueue with a tracer (or inside another traced block).
+    """
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    with parent.tracer.span(name, category, **args) as child:
+        yield child
@@ -109,7 +109,7 @@ def main():
     repo = initialize_git()
     
     # Initialize task queue
-    task_queue = TaskQueue(max_workers=2)
+    task_queue = TaskQueue(max_workers=2, max_finished_tasks=500)
     task_queue.start()
     
     # Initialize browser
@@ -133,19 +133,14 @@ def main():
                     retry_delay=5
                 )
                 
-                # Add iteration task with high priority
-                iteration_task_id = task_queue.add_task(iteration_task, priority=1)
-                
-                # Wait for iteration task completion
-                while True:
-                    status = task_queue.get_task_status(iteration_task_id)
-                    if status['status'] in ['completed', 'failed']:
-                        if status['status'] == 'failed':
-                            logging.error(f"Iteration {iteration} failed: {status['error']}")
-                            # Retry the entire iteration
-                            continue
-                        break
-                    time.sleep(1)
+                # Add iteration task with high priority and wait for it to finish
+                iteration_future = task_queue.submit(iteration_task, priority=1)
+                try:
+                    iteration_future.result()
+                except Exception as e:
+                    logging.error(f"Iteration {iteration} failed: {str(e)}")
+                    # Retry the entire iteration
+                    continue
                 
                 # Commit and push every 25 iterations
                 if iteration - last_commit_iteration >= 25:
@@ -156,16 +151,11 @@ def main():
                         max_retries=2,
                         retry_delay=10
                     )
-                    commit_task_id = task_queue.add_task(commit_task, priority=0)
+                    commit_future = task_queue.submit(commit_task, priority=0)
                     
                     # Wait for commit task completion
-                    while True:
-                        status = task_queue.get_task_status(commit_task_id)
-                        if status['status'] in ['completed', 'failed']:
-                            if status['status'] == 'completed':
-                                last_commit_iteration = iteration
-                            break
-                        time.sleep(1)
+                    if commit_future.exception() is None:
+                        last_commit_iteration = iteration
                 
                 iteration += 1
                 
@@ -48,13 +48,15 @@ def determine_file_path(code_block, content):
     extension = language_to_extension.get(code_block['language'], '.txt')
     return f"generated_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
 
-def write_changes():
+def write_changes(input_file="ai_3_out.txt", output_dir="."):
     """
     Reads ai_3_out.txt and applies the generated changes to the codebase.
+    
+    Relative file paths are written under output_dir.
     """
     try:
         # 1. Read ai_3_out.txt
-        with open("ai_3_out.txt", "r", encoding="utf-8") as f:
+        with open(input_file, "r", encoding="utf-8") as f:
             content = f.read()
         
         # 2. Parse implementation
@@ -62,7 +64,7 @@ def write_changes():
         
         # 3. Apply changes to files
         for block in code_blocks:
-            file_path = determine_file_path(block, content)
+            file_path = os.path.join(output_dir, determine_file_path(block, content))
             
             # Create directory if it doesn't exist
             os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
@@ -10,19 +10,32 @@ from pathlib import Path
 def main():
     """Main entry point with command line argument parsing."""
     parser = argparse.ArgumentParser(description='EchoLoop Automation System')
-    parser.add_argument('component', choices=['loop', 'web', 'gemini', 'test'], 
+    parser.add_argument('component', choices=['loop', 'coordinator', 'web', 'gemini', 'test'], 
                        help='Component to run')
     parser.add_argument('--headless', action='store_true', 
                        help='Run browser in headless mode')
     parser.add_argument('--port', type=int, default=5000,
                        help='Port for web interface (default: 5000)')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='Overlap the stages of consecutive loop iterations')
+    parser.add_argument('--workers', type=int, default=2,
+                       help='Worker processes for the coordinator (default: 2)')
+    parser.add_argument('--prompts', default='data/prompts.txt',
+                       help='Prompts for the coordinator, separated by --- lines (default: data/prompts.txt)')
     
     args = parser.parse_args()
     
     if args.component == 'loop':
         print("🔄 Starting EchoLoop main automation...")
         from core.echo_loop import main as echo_main
-        echo_main()
+        echo_main(pipelined=args.pipeline)
+        
+    elif args.component == 'coordinator':
+        print(f"🔀 Starting coordinator with {args.workers} workers...")
+        from core.coordinator import Coordinator, load_prompts
+        status = Coordinator(load_prompts(args.prompts), workers=args.workers, headless=args.headless).run()
+        print(f"🔀 Completed {status['completed']} of {status['prompts']} prompts")
+        sys.exit(0 if status['completed'] == status['prompts'] else 1)
         
     elif args.component == 'web':
         print(f"🌐 Starting web monitoring interface on port {args.port}...")
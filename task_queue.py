@@ -5,6 +5,15 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Callable, List, Optional
 import traceback
+import itertools
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from concurrent.futures import Future, CancelledError
+from pathlib import Path
+
+from core.timer import DeadlineTimer, retry_delay
+from core.archive import TaskArchive
+from core.cancellation import CancelToken, TaskTimeoutError, set_current_token
 
 # Set up logging
 logging.basicConfig(
@@ -15,7 +24,9 @@ logging.basicConfig(
 
 class Task:
     def __init__(self, name: str, func: Callable, args: tuple = (), kwargs: dict = None,
-                 max_retries: int = 3, retry_delay: int = 5, dependencies: List[str] = None):
+                 max_retries: int = 3, retry_delay: int = 5, dependencies: List[str] = None,
+                 backoff: float = 2.0, max_retry_delay: float = 300, jitter: float = 0.1,
+                 timeout: Optional[float] = None, retry_on_timeout: bool = True):
         self.name = name
         self.func = func
         self.args = args
@@ -29,18 +40,259 @@ class Task:
         self.retry_count = 0
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.backoff = backoff
+        self.max_retry_delay = max_retry_delay
+        self.jitter = jitter
+        self.timeout = timeout
+        self.retry_on_timeout = retry_on_timeout
+        self.attempt = 0
+        self.cancel_token = None  # CancelToken of the current attempt
+        self.worker = None  # thread running the current attempt
+        self.priority = 0
         self.dependencies = dependencies or []
         self.dependency_status = {dep: False for dep in self.dependencies}
+        self.future = Future()  # resolved when the task completes or fails for good
+        self.indegree = 0  # number of dependencies that have not completed yet
+
+SNAPSHOT_SHARDS = 64
+ID_BLOCK_SIZE = 256  # ids per block of a SortedIds; blocks split at twice this
+DEFAULT_ARCHIVE_PATH = Path(__file__).parent / 'logs' / 'task_archive.jsonl'
+
+def task_record(task: Task) -> tuple:
+    """Raw status record of a task, cheap enough to build on every transition."""
+    dependency_status = task.dependency_status
+    return (task.name, task.status, task.created_at, task.started_at, task.completed_at, task.result,
+            task.error, task.retry_count, task.dependencies,
+            dict(dependency_status) if dependency_status else dependency_status)
+
+def format_record(record: tuple) -> Dict[str, Any]:
+    """The status dict of a raw record, as returned by ``get_task_status``."""
+    (name, status, created_at, started_at, completed_at, result, error,
+     retry_count, dependencies, dependency_status) = record
+    return {
+        'name': name,
+        'status': status,
+        'created_at': created_at.isoformat(),
+        'started_at': started_at.isoformat() if started_at else None,
+        'completed_at': completed_at.isoformat() if completed_at else None,
+        'result': result,
+        'error': str(error) if error else None,
+        'retry_count': retry_count,
+        'dependencies': list(dependencies),
+        'dependency_status': dict(dependency_status)
+    }
+
+class SortedIds:
+    """Sorted list of task ids stored in blocks.
+    
+    ``copy`` shares the blocks with the original, and a block is only
+    copied when the copy first changes it, so copying an index for every
+    published snapshot costs O(n / ID_BLOCK_SIZE) rather than O(n).
+    """
+    
+    __slots__ = ('blocks', 'maxes', 'owned')
+    
+    def __init__(self, blocks: Optional[List[List[str]]] = None, maxes: Optional[List[str]] = None):
+        self.blocks = blocks or []
+        self.maxes = maxes or []  # last id of each block, for bisecting to a block
+        self.owned = set()  # ids of blocks this list may change in place
+    
+    def __len__(self) -> int:
+        return sum(len(block) for block in self.blocks)
+    
+    def copy(self) -> 'SortedIds':
+        return SortedIds(self.blocks.copy(), self.maxes.copy())
+    
+    def add(self, task_id: str):
+        if not self.blocks:
+            self.blocks.append([task_id])
+            self.maxes.append(task_id)
+            self.owned.add(id(self.blocks[0]))
+            return
+        index = bisect_left(self.maxes, task_id)
+        if index == len(self.maxes):
+            index -= 1
+        block = self.blocks[index]
+        if id(block) not in self.owned:
+            block = self._writable(index)
+        insort(block, task_id)
+        self.maxes[index] = block[-1]
+        if len(block) > 2 * ID_BLOCK_SIZE:
+            tail = block[ID_BLOCK_SIZE:]
+            del block[ID_BLOCK_SIZE:]
+            self.blocks.insert(index + 1, tail)
+            self.maxes[index] = block[-1]
+            self.maxes.insert(index + 1, tail[-1])
+            self.owned.add(id(tail))
+    
+    def remove(self, task_id: str):
+        """Remove an id if present."""
+        index = bisect_left(self.maxes, task_id)
+        if index == len(self.maxes):
+            return
+        block = self.blocks[index]
+        position = bisect_left(block, task_id)
+        if block[position] != task_id:
+            return
+        if id(block) not in self.owned:
+            block = self._writable(index)
+        del block[position]
+        if block:
+            self.maxes[index] = block[-1]
+        else:
+            del self.blocks[index]
+            del self.maxes[index]
+            self.owned.discard(id(block))
+    
+    def find(self, prefix: str = '') -> List[str]:
+        """Ids starting with prefix, in order."""
+        # Every id starting with prefix sorts before prefix + U+10FFFF
+        end = prefix + '\U0010ffff' if prefix else None
+        ids = []
+        index = bisect_left(self.maxes, prefix)
+        start = bisect_left(self.blocks[index], prefix) if index < len(self.blocks) else 0
+        for block in self.blocks[index:]:
+            stop = len(block) if end is None else bisect_left(block, end, start)
+            ids.extend(block[start:stop])
+            if stop < len(block):
+                break
+            start = 0
+        return ids
+    
+    def _writable(self, index: int) -> List[str]:
+        """Replace the shared block at index with a copy this list owns, and return it."""
+        block = self.blocks[index] = self.blocks[index].copy()
+        self.owned.add(id(block))
+        return block
+
+class TaskSnapshot:
+    """Immutable, versioned view of the status records of all live tasks.
+    
+    Records are spread over ``SNAPSHOT_SHARDS`` dicts by hash of the task id.
+    An update copies just the shards it touches into a new snapshot, so
+    older snapshots held by readers never change underneath them. Records
+    are stored raw (see ``task_record``) and only formatted into status
+    dicts by ``get`` and ``items``, in the reader's thread.
+    
+    ``indexes`` holds the queue's SortedIds as of the snapshot, per status
+    and under None for all live tasks, so ``find`` answers a status and
+    prefix query in time proportional to the number of matches.
+    """
+    
+    __slots__ = ('version', 'shards', 'indexes')
+    
+    def __init__(self, version: int, shards: List[Dict[str, tuple]], indexes: Dict[Optional[str], SortedIds]):
+        self.version = version
+        self.shards = shards  # never modified once the snapshot is published
+        self.indexes = indexes  # likewise
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+    
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self.shards[hash(task_id) % len(self.shards)]
+    
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        record = self.shards[hash(task_id) % len(self.shards)].get(task_id)
+        return format_record(record) if record is not None else None
+    
+    def items(self):
+        """(task_id, status dict) pairs of every task."""
+        for shard in self.shards:
+            for task_id, record in shard.items():
+                yield task_id, format_record(record)
+    
+    def find(self, status: Optional[str] = None, prefix: str = '') -> List[str]:
+        """Sorted ids of tasks with the given status and/or id prefix."""
+        ids = self.indexes.get(status)
+        return ids.find(prefix) if ids is not None else []
+    
+    def updated(self, records: Dict[str, Optional[tuple]],
+                indexes: Dict[Optional[str], SortedIds]) -> 'TaskSnapshot':
+        """New snapshot with the given records replaced (or removed where the record is None) and new indexes."""
+        shards = self.shards.copy()
+        copied = set()
+        for task_id, record in records.items():
+            index = hash(task_id) % len(shards)
+            if index not in copied:
+                shards[index] = dict(shards[index])
+                copied.add(index)
+            if record is None:
+                shards[index].pop(task_id, None)
+            else:
+                shards[index][task_id] = record
+        return TaskSnapshot(self.version + 1, shards, indexes)
+    
+    def with_record(self, task_id: str, record: Optional[tuple],
+                    indexes: Dict[Optional[str], SortedIds]) -> 'TaskSnapshot':
+        """``updated`` for a single record, the common case."""
+        shards = self.shards.copy()
+        index = hash(task_id) % len(shards)
+        shard = shards[index] = shards[index].copy()
+        if record is None:
+            shard.pop(task_id, None)
+        else:
+            shard[task_id] = record
+        return TaskSnapshot(self.version + 1, shards, indexes)
+
+class WriteSection:
+    """``with`` block that holds a TaskQueue's lock and publishes its snapshot on exit."""
+    
+    __slots__ = ('queue', 'lock')
+    
+    def __init__(self, queue: 'TaskQueue'):
+        self.queue = queue
+        self.lock = queue.lock
+    
+    def __enter__(self):
+        self.lock.acquire()
+    
+    def __exit__(self, *exc_info):
+        try:
+            if self.queue._dirty:
+                self.queue._publish_snapshot()
+        finally:
+            self.lock.release()
 
 class TaskQueue:
-    def __init__(self, max_workers: int = 4):
+    """Task queue that schedules tasks as a dependency DAG.
+    
+    A task becomes ready once all its dependencies completed, and a failed
+    or cancelled task fails its transitive dependents. Readers get a
+    copy-on-write ``TaskSnapshot`` published by every change, so they
+    never take the scheduler lock.
+    """
+    
+    def __init__(self, max_workers: int = 4, max_finished_tasks: Optional[int] = None,
+                 max_task_age: Optional[float] = None, archive_path=None):
+        """
+        ``max_finished_tasks`` / ``max_task_age`` (seconds): move the oldest
+        finished tasks to the archive at ``archive_path``, which
+        ``get_task_status`` and dependency checks fall back to.
+        """
         self.queue = queue.PriorityQueue()
         self.max_workers = max_workers
         self.workers = []
         self.running = False
         self.tasks: Dict[str, Task] = {}
         self.lock = threading.Lock()
-        self.task_events: Dict[str, threading.Event] = {}
+        self.dependents: Dict[str, List[str]] = {}  # task_id -> ids of tasks waiting on it
+        self.id_counters: Dict[str, itertools.count] = {}  # task name -> next sequence number
+        self.sorted_ids = SortedIds()  # ids of live tasks
+        self.ids_by_status: Dict[str, SortedIds] = {}  # status -> ids of live tasks
+        self._snapshot = TaskSnapshot(0, [{} for _ in range(SNAPSHOT_SHARDS)], {None: self.sorted_ids})
+        self._owned_ids = set()  # statuses (None: all) whose id lists were copied in the current write section
+        self._dirty = set()  # ids of tasks changed in the current write section
+        self._write_section = WriteSection(self)
+        self.timer = DeadlineTimer(name="TaskRetryTimer")
+        self.retrying: Dict[str, Task] = {}  # task_id -> task waiting on the timer for its retry
+        self.abandoned_workers = set()  # workers stuck in a timed-out attempt
+        self.max_finished_tasks = max_finished_tasks
+        self.max_task_age = max_task_age
+        self.finished = OrderedDict()  # task_id -> monotonic finish time, oldest first
+        self.archive = None
+        if max_finished_tasks is not None or max_task_age is not None:
+            self.archive = TaskArchive(archive_path or DEFAULT_ARCHIVE_PATH)
     
     def start(self):
         """Start the task queue workers."""
@@ -48,83 +300,260 @@ class TaskQueue:
             return
         
         self.running = True
-        for _ in range(self.max_workers):
-            worker = threading.Thread(target=self._worker_loop, daemon=True)
-            worker.start()
-            self.workers.append(worker)
+        self.timer.start()
+        with self.lock:
+            for _ in range(self.max_workers):
+                self._start_worker()
         
         logging.info(f"Started {self.max_workers} workers")
     
     def stop(self):
         """Stop the task queue workers."""
         self.running = False
-        for worker in self.workers:
+        self.timer.stop()
+        # The timer dropped their retries; resolve them rather than leave them pending
+        with self.lock:
+            retrying, self.retrying = self.retrying, {}
+        for task_id, task in retrying.items():
+            self._cancel_stopped(task_id, task)
+        for worker in list(self.workers):
             worker.join()
         self.workers.clear()
         logging.info("Stopped all workers")
     
     def add_task(self, task: Task, priority: int = 0) -> str:
-        """Add a task to the queue with priority."""
-        with self.lock:
-            task_id = f"{task.name}_{int(time.time())}"
+        """Add a task to the queue with priority. Returns its id, ``<name>_<n>``, unique per name."""
+        with self._writing():
+            task_id = self._new_task_id(task.name)
+            task.priority = priority
+            task.future.task_id = task_id
             self.tasks[task_id] = task
-            self.task_events[task_id] = threading.Event()
-            self.queue.put((priority, task_id, task))
+            self._writable_ids(None).add(task_id)
+            self._writable_ids(task.status).add(task_id)
+            
+            failed_dependency = None
+            for dep in task.dependencies:
+                dep_status = self._known_status(dep)
+                if dep_status == 'completed':
+                    task.dependency_status[dep] = True
+                elif dep_status in ('failed', 'cancelled'):
+                    failed_dependency = dep
+                else:
+                    # Unknown ids are waited on until a task with that id is added
+                    task.indegree += 1
+                    self.dependents.setdefault(dep, []).append(task_id)
+            
+            self._touch(task_id)
+            if failed_dependency is None and task.indegree == 0:
+                self.queue.put((priority, task_id, task))
             logging.info(f"Added task: {task_id}")
-            return task_id
+        
+        if failed_dependency is not None:
+            self._fail_dependents(failed_dependency, [task_id])
+        return task_id
+    
+    def submit(self, task: Task, priority: int = 0) -> Future:
+        """Add a task and return a concurrent.futures.Future for its result."""
+        self.add_task(task, priority)
+        return task.future
+    
+    def find_tasks(self, status: Optional[str] = None, prefix: str = '') -> List[str]:
+        """Ids of live tasks with the given status and/or id prefix, sorted.
+        
+        Archived tasks are not included. Lock-free, like ``snapshot``.
+        """
+        return self.snapshot().find(status, prefix)
+    
+    def snapshot(self) -> TaskSnapshot:
+        """The latest published snapshot of all live tasks. Lock-free."""
+        return self._snapshot
     
     def get_task_status(self, task_id: str) -> Dict[str, Any]:
         """Get the status of a task."""
-        with self.lock:
+        record = self.snapshot().get(task_id)
+        if record is not None:
+            return record
+        
+        record = self.archive.get(task_id) if self.archive else None
+        if not record:
+            return {'error': 'Task not found'}
+        record.pop('task_id', None)
+        return record
+    
+    def _new_task_id(self, name: str) -> str:
+        """Next unused id for a task name. Must be called with the lock held."""
+        counter = self.id_counters.setdefault(name, itertools.count())
+        while True:
+            task_id = f"{name}_{next(counter)}"
+            # Skip ids archived by an earlier run
+            if task_id not in self.tasks and not (self.archive and task_id in self.archive):
+                return task_id
+    
+    def _set_status(self, task_id: str, task: Task, status: str):
+        """Move a task to a new status, keeping the status index and snapshot in step.
+        
+        Must be called with the lock held, after the task's other fields for
+        this transition have been set.
+        """
+        self._writable_ids(task.status).remove(task_id)
+        task.status = status
+        self._writable_ids(status).add(task_id)
+        self._touch(task_id)
+    
+    def _touch(self, task_id: str):
+        """Mark a task's snapshot record stale. Must be called with the lock held."""
+        self._dirty.add(task_id)
+    
+    def _writable_ids(self, status: Optional[str]) -> SortedIds:
+        """Ids of a status (of all live tasks for None), safe to modify.
+        
+        Must be called in a write section. An index shared with the published
+        snapshot is copied first, so the indexes readers hold never change.
+        """
+        if status in self._owned_ids:
+            return self.sorted_ids if status is None else self.ids_by_status[status]
+        ids = self.sorted_ids if status is None else self.ids_by_status.get(status, SortedIds())
+        ids = ids.copy()
+        if status is None:
+            self.sorted_ids = ids
+        else:
+            self.ids_by_status[status] = ids
+        self._owned_ids.add(status)
+        return ids
+    
+    def _writing(self) -> 'WriteSection':
+        """Context manager holding the lock for a section that changes tasks, then publishing them."""
+        return self._write_section
+    
+    def _publish_snapshot(self):
+        """Publish a snapshot with the records of changed tasks rebuilt. Must be called with the lock held."""
+        dirty = self._dirty
+        indexes = self._snapshot.indexes
+        if self._owned_ids:
+            indexes = {None: self.sorted_ids, **self.ids_by_status}
+            self._owned_ids.clear()
+        if len(dirty) == 1:
+            # The common case: one task changed
+            task_id = dirty.pop()
             task = self.tasks.get(task_id)
-            if not task:
-                return {'error': 'Task not found'}
-            
-            return {
-                'name': task.name,
-                'status': task.status,
-                'created_at': task.created_at.isoformat(),
-                'started_at': task.started_at.isoformat() if task.started_at else None,
-                'completed_at': task.completed_at.isoformat() if task.completed_at else None,
-                'result': task.result,
-                'error': str(task.error) if task.error else None,
-                'retry_count': task.retry_count,
-                'dependencies': task.dependencies,
-                'dependency_status': task.dependency_status
-            }
-    
-    def get_all_tasks(self) -> Dict[str, Dict[str, Any]]:
-        """Get the status of all tasks."""
-        with self.lock:
-            return {
-                task_id: self.get_task_status(task_id)
-                for task_id in self.tasks
-            }
+            self._snapshot = self._snapshot.with_record(task_id, task_record(task) if task else None, indexes)
+        elif dirty:
+            records = {}
+            for task_id in dirty:
+                task = self.tasks.get(task_id)
+                records[task_id] = task_record(task) if task is not None else None
+            dirty.clear()
+            self._snapshot = self._snapshot.updated(records, indexes)
+    
+    def _known_status(self, task_id: str) -> Optional[str]:
+        """Status of a live or archived task, or None if the id is unknown."""
+        task = self.tasks.get(task_id)
+        if task:
+            return task.status
+        if self.archive and task_id in self.archive:
+            return self.archive.get(task_id)['status']
+        return None
+    
+    def _mark_finished(self, task_id: str) -> List[Dict[str, Any]]:
+        """Record that a task finished and evict tasks beyond the retention limits.
+        
+        Must be called with the lock held; pass the returned records to
+        ``_archive`` once the lock is released.
+        """
+        if self.archive is None:
+            return []
+        now = time.monotonic()
+        self.finished[task_id] = now
+        evicted = []
+        while self.finished:
+            oldest_id, finished_at = next(iter(self.finished.items()))
+            over_count = self.max_finished_tasks is not None and len(self.finished) > self.max_finished_tasks
+            over_age = self.max_task_age is not None and now - finished_at > self.max_task_age
+            if not (over_count or over_age):
+                break
+            del self.finished[oldest_id]
+            task = self.tasks.pop(oldest_id)
+            self._writable_ids(None).remove(oldest_id)
+            self._writable_ids(task.status).remove(oldest_id)
+            self._touch(oldest_id)
+            evicted.append({'task_id': oldest_id, **format_record(task_record(task))})
+        return evicted
     
-    def _check_dependencies(self, task: Task) -> bool:
-        """Check if all dependencies are completed."""
-        return all(task.dependency_status.values())
+    def _archive(self, records: List[Dict[str, Any]]):
+        """Write evicted task records to the archive."""
+        if records:
+            try:
+                self.archive.append(records)
+            except OSError as e:
+                logging.error(f"Error archiving {len(records)} tasks: {str(e)}")
+    
+    def get_all_tasks(self, status: Optional[str] = None, prefix: str = '') -> Dict[str, Dict[str, Any]]:
+        """Get the status of all live tasks, optionally filtered as in ``find_tasks``.
+        
+        Reads one consistent snapshot without taking the lock. Filtered
+        results come from the snapshot's id indexes, sorted by id, in time
+        proportional to the number of matches; use ``find_tasks`` for just
+        the ids.
+        """
+        snapshot = self.snapshot()
+        if not (status or prefix):
+            return dict(snapshot.items())
+        return {task_id: snapshot.get(task_id) for task_id in snapshot.find(status, prefix)}
     
     def _update_dependency_status(self, task_id: str, status: bool):
-        """Update dependency status for dependent tasks."""
-        with self.lock:
-            for tid, task in self.tasks.items():
-                if task_id in task.dependencies:
-                    task.dependency_status[task_id] = status
-                    if status and self._check_dependencies(task):
-                        self.task_events[tid].set()
+        """Release or fail the dependents of a task that just finished."""
+        if not status:
+            with self.lock:
+                dependents = self.dependents.pop(task_id, [])
+            self._fail_dependents(task_id, dependents)
+            return
+        
+        with self._writing():
+            for tid in self.dependents.pop(task_id, []):
+                task = self.tasks.get(tid)
+                if task is None:
+                    continue  # already finished and evicted
+                task.dependency_status[task_id] = True
+                self._touch(tid)
+                task.indegree -= 1
+                if task.indegree == 0 and task.status == 'pending':
+                    self.queue.put((task.priority, tid, task))
+    
+    def _fail_dependents(self, task_id: str, dependents: List[str]):
+        """Fail every task that transitively depends on a failed task."""
+        failed = []
+        evicted = []
+        with self._writing():
+            stack = [(task_id, tid) for tid in dependents]
+            while stack:
+                cause, tid = stack.pop()
+                task = self.tasks.get(tid)
+                if task is None or task.status != 'pending':
+                    continue
+                task.completed_at = datetime.now()
+                task.error = RuntimeError(f"Dependency {cause} did not complete")
+                self._set_status(tid, task, 'failed')
+                failed.append((tid, task))
+                stack.extend((tid, dependent) for dependent in self.dependents.pop(tid, []))
+                evicted.extend(self._mark_finished(tid))
+        
+        self._archive(evicted)
+        for tid, task in failed:
+            task.future.set_exception(task.error)
+            logging.error(f"Failed task: {tid} - {task.error}")
+    
+    def _start_worker(self):
+        """Start one worker thread. Must be called with the lock held."""
+        worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self.workers.append(worker)
+        worker.start()
     
     def _worker_loop(self):
         """Worker loop that processes tasks from the queue."""
-        while self.running:
+        me = threading.current_thread()
+        while self.running and me not in self.abandoned_workers:
             try:
                 priority, task_id, task = self.queue.get(timeout=1)
-                
-                # Wait for dependencies
-                if task.dependencies:
-                    if not self._check_dependencies(task):
-                        self.task_events[task_id].wait()
-                
                 self._process_task(task_id, task)
                 self.queue.task_done()
                 
@@ -132,48 +561,159 @@ class TaskQueue:
                 continue
             except Exception as e:
                 logging.error(f"Error in worker loop: {str(e)}\n{traceback.format_exc()}")
+        
+        with self.lock:
+            self.abandoned_workers.discard(me)
     
     def _process_task(self, task_id: str, task: Task):
-        """Process a single task with retries."""
-        while task.retry_count <= task.max_retries:
-            try:
-                # Update task status
-                with self.lock:
-                    task.status = 'running'
-                    task.started_at = datetime.now()
-                
-                # Execute task
-                result = task.func(*task.args, **task.kwargs)
-                
-                # Update task status
-                with self.lock:
-                    task.status = 'completed'
-                    task.completed_at = datetime.now()
-                    task.result = result
-                
-                # Update dependency status
-                self._update_dependency_status(task_id, True)
-                
-                logging.info(f"Completed task: {task_id}")
+        """Process a single task attempt, scheduling a delayed retry on failure."""
+        if task.retry_count == 0 and not task.future.set_running_or_notify_cancel():
+            with self._writing():
+                task.completed_at = datetime.now()
+                self._set_status(task_id, task, 'cancelled')
+                evicted = self._mark_finished(task_id)
+            self._archive(evicted)
+            self._update_dependency_status(task_id, False)
+            logging.info(f"Skipped cancelled task: {task_id}")
+            return
+        
+        # Update task status
+        with self._writing():
+            task.attempt += 1
+            attempt = task.attempt
+            task.started_at = datetime.now()
+            self._set_status(task_id, task, 'running')
+            token = task.cancel_token = CancelToken()
+            task.worker = threading.current_thread()
+            deadline = None
+            if task.timeout:
+                deadline = self.timer.call_later(task.timeout, self._on_timeout, task_id, task, attempt)
+        
+        previous_token = set_current_token(token)
+        error = None
+        try:
+            # Execute task
+            result = task.func(*task.args, **task.kwargs)
+        except Exception as e:
+            result = None
+            error = e
+        finally:
+            set_current_token(previous_token)
+            # Cancel the deadline before handling the outcome
+            if deadline:
+                self.timer.cancel(deadline)
+        
+        # Update task status; the stale check and the transition share one section
+        # so the watchdog and this worker never both handle the attempt
+        with self._writing():
+            if task.attempt != attempt or task.status != 'running':
+                logging.warning(f"Discarding late {'failure' if error else 'result'} of timed out task: {task_id}")
                 return
-                
-            except Exception as e:
-                task.retry_count += 1
-                if task.retry_count > task.max_retries:
-                    # Update task status
-                    with self.lock:
-                        task.status = 'failed'
-                        task.completed_at = datetime.now()
-                        task.error = e
-                    
-                    # Update dependency status
-                    self._update_dependency_status(task_id, False)
-                    
-                    logging.error(f"Failed task: {task_id} - {str(e)}\n{traceback.format_exc()}")
-                    return
-                
-                logging.warning(f"Retrying task {task_id} (attempt {task.retry_count}/{task.max_retries})")
-                time.sleep(task.retry_delay)
+            if error is not None:
+                evicted, delay = self._record_failure(task_id, task, error)
+            else:
+                task.completed_at = datetime.now()
+                task.result = result
+                self._set_status(task_id, task, 'completed')
+                evicted = self._mark_finished(task_id)
+        if error is not None:
+            self._finish_failure(task_id, task, error, evicted, delay)
+            return
+        self._archive(evicted)
+        task.future.set_result(result)
+        
+        # Update dependency status
+        self._update_dependency_status(task_id, True)
+        
+        logging.info(f"Completed task: {task_id}")
+    
+    def _record_failure(self, task_id: str, task: Task, e: Exception):
+        """Schedule a retry of a failed attempt, or fail the task for good.
+        
+        Must be called inside a write section. Returns ``(evicted, delay)``
+        for ``_finish_failure``, which must be called once the lock is
+        released; ``delay`` is None if the task failed for good.
+        """
+        task.retry_count += 1
+        retry = task.retry_count <= task.max_retries
+        if isinstance(e, TaskTimeoutError) and not task.retry_on_timeout:
+            retry = False
+        
+        if not retry:
+            task.completed_at = datetime.now()
+            task.error = e
+            self._set_status(task_id, task, 'failed')
+            return self._mark_finished(task_id), None
+        
+        # Re-queue from the timer thread so this worker stays free
+        delay = retry_delay(task.retry_delay, task.retry_count, task.backoff,
+                            task.max_retry_delay, task.jitter)
+        self._set_status(task_id, task, 'pending')
+        self.retrying[task_id] = task
+        self.timer.call_later(delay, self._requeue, task_id, task)
+        return [], delay
+    
+    def _finish_failure(self, task_id: str, task: Task, e: Exception, evicted: List[Dict[str, Any]],
+                        delay: Optional[float]):
+        """Archive, resolve and log a failure recorded by ``_record_failure``."""
+        if delay is not None:
+            logging.warning(f"Retrying task {task_id} in {delay:.1f}s (attempt {task.retry_count}/{task.max_retries})")
+            return
+        self._archive(evicted)
+        task.future.set_exception(e)
+        
+        # Update dependency status
+        self._update_dependency_status(task_id, False)
+        
+        # Also called from the watchdog timer, where no exception is being handled
+        details = ''.join(traceback.format_exception(type(e), e, e.__traceback__))
+        logging.error(f"Failed task: {task_id} - {str(e)}\n{details}")
+    
+    def _on_timeout(self, task_id: str, task: Task, attempt: int):
+        """Watchdog timer callback: cancel the attempt's token, fail it and replace its stuck worker."""
+        error = TaskTimeoutError(f"Task {task_id} timed out after {task.timeout}s")
+        with self._writing():
+            if task.attempt != attempt or task.status != 'running':
+                return  # finished in time
+            task.cancel_token.cancel('timeout')
+            
+            # Replace the stuck worker so throughput recovers
+            stuck = task.worker
+            if stuck in self.workers:
+                self.workers.remove(stuck)
+                self.abandoned_workers.add(stuck)
+                if self.running:
+                    self._start_worker()
+            # The attempt is over, so the stuck worker's late outcome is dropped
+            evicted, delay = self._record_failure(task_id, task, error)
+        
+        logging.error(str(error))
+        self._finish_failure(task_id, task, error, evicted, delay)
+    
+    def _requeue(self, task_id: str, task: Task):
+        """Timer callback: put a task back on the queue after its retry delay.
+        
+        A task whose retry comes due after ``stop()`` is cancelled instead.
+        """
+        with self.lock:
+            self.retrying.pop(task_id, None)
+        if self.running:
+            self.queue.put((task.priority, task_id, task))
+            return
+        self._cancel_stopped(task_id, task)
+    
+    def _cancel_stopped(self, task_id: str, task: Task):
+        """Cancel a task whose retry can no longer run because the queue stopped."""
+        with self._writing():
+            if task.status != 'pending':
+                return
+            task.completed_at = datetime.now()
+            self._set_status(task_id, task, 'cancelled')
+            evicted = self._mark_finished(task_id)
+        self._archive(evicted)
+        task.future.set_exception(CancelledError(f"Task {task_id} was cancelled: queue stopped before its retry"))
+        self._update_dependency_status(task_id, False)
+        logging.info(f"Cancelled task {task_id}: queue stopped before its retry")
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Tests for the core TaskQueue
+"""
+
+import asyncio
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import CancelledError
+
+from core.journal import TaskJournal
+from core.scheduler import IndexedHeap
+from core.task_queue import TaskQueue, Task
+from core.async_task_queue import AsyncTaskQueue, AsyncTask
+from core.stage_graph import StageGraph
+import task_queue as root_queue
+
+def test_resubmit_same_id_and_key_coalesces_while_running():
+    """Resubmitting a running task with its own id and idempotency key returns its future."""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'done'
+
+    queue = TaskQueue(max_workers=2)
+    queue.start()
+    try:
+        first = queue.submit(Task('iteration_1', work, idempotency_key='iteration_1'))
+        assert started.wait(5)
+        second = queue.submit(Task('iteration_1', work, idempotency_key='iteration_1'))
+        assert second is first
+        assert queue.add_task(Task('iteration_1', work, idempotency_key='iteration_1')) == 'iteration_1'
+        release.set()
+        assert first.result(5) == 'done'
+        assert calls == [1]
+        assert queue.get_queue_stats()['coalesced'] == 2
+    finally:
+        release.set()
+        queue.stop()
+
+def test_resubmit_same_id_without_key_is_rejected_while_running():
+    """Without an idempotency key a live task id is still a conflict."""
+    release = threading.Event()
+    queue = TaskQueue(max_workers=1)
+    queue.start()
+    try:
+        queue.submit(Task('iteration_1', release.wait, args=(5,)))
+        try:
+            queue.submit(Task('iteration_1', release.wait, args=(5,)))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("duplicate task id was accepted")
+    finally:
+        release.set()
+        queue.stop()
+
+def test_stop_cancels_tasks_waiting_for_retry_or_refill():
+    """stop() resolves the futures of tasks the stopped timer would have woken."""
+    def broken():
+        raise ValueError("boom")
+
+    queue = TaskQueue(max_workers=1, resources={'slow': {'rate': 0.1, 'burst': 1}})
+    queue.start()
+    retrying = queue.submit(Task('retrying', broken, retry_delay=1))
+    first = queue.submit(Task('first', lambda: 1, resources=['slow']))
+    parked = queue.submit(Task('parked', lambda: 2, resources=['slow']))
+    assert first.result(5) == 1
+    while queue.get_queue_stats()['blocked'] == 0 or queue.get_task_status('retrying')['error'] is None:
+        threading.Event().wait(0.01)
+    queue.stop()
+    for task_id, future in (('retrying', retrying), ('parked', parked)):
+        try:
+            future.result(2)
+        except CancelledError:
+            pass
+        else:
+            raise AssertionError(f"{task_id} was not cancelled")
+        assert queue.get_task_status(task_id)['status'] == 'cancelled'
+
+def test_async_stop_cancels_waiting_and_retrying_tasks():
+    """AsyncTaskQueue.stop() resolves every unfinished task, not only the ones in flight."""
+    async def scenario():
+        queue = AsyncTaskQueue(max_concurrency=1)
+        await queue.start()
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def broken():
+            raise ValueError("boom")
+
+        queue.add_task(AsyncTask('retrying', broken, retry_delay=10), priority=1)
+        await asyncio.sleep(0.05)
+        for task_id in ('a', 'b', 'c'):
+            queue.add_task(AsyncTask(task_id, slow))
+        queue.add_task(AsyncTask('after_c', slow, dependencies=['c']))
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    for task_id in ('retrying', 'a', 'b', 'c'):
+        assert queue.get_task_status(task_id)['status'] == 'cancelled'
+        assert queue.tasks[task_id].future.done()
+    assert queue.get_task_status('after_c')['status'] == 'failed'
+
+def test_root_snapshot_indexes_are_consistent_and_immutable():
+    """Filtered get_all_tasks reads the snapshot's id indexes, which later writes never change."""
+    queue = root_queue.TaskQueue(max_workers=1)
+    for number in range(600):
+        queue.add_task(root_queue.Task(f"iteration{number % 3}", int))
+    before = queue.snapshot()
+    queue.start()
+    try:
+        for future in [queue.tasks[task_id].future for task_id in before.find('pending')]:
+            future.result(5)
+    finally:
+        queue.stop()
+    assert len(before.find('pending')) == 600
+    assert before.find('completed') == []
+    assert before.get('iteration0_0')['status'] == 'pending'
+    completed = queue.get_all_tasks(status='completed', prefix='iteration1_')
+    assert list(completed) == sorted(f"iteration1_{n}" for n in range(200))
+    assert all(record['status'] == 'completed' for record in completed.values())
+    assert queue.find_tasks('pending') == []
+    assert len(queue.get_all_tasks()) == 600
+
+def test_indexed_heap_pops_equal_keys_in_fifo_order():
+    """Items with equal keys come out in the order they were pushed."""
+    heap = IndexedHeap()
+    for item_id, key in (('a', 1), ('b', 0), ('c', 1), ('d', 0), ('e', 1)):
+        heap.push(item_id, item_id.upper(), key)
+    assert [heap.pop() for _ in range(len(heap))] == [('b', 'B'), ('d', 'D'), ('a', 'A'), ('c', 'C'), ('e', 'E')]
+
+def test_indexed_heap_remove_and_update_keep_order():
+    """Removing and re-keying items keeps the heap order and the FIFO tiebreak."""
+    heap = IndexedHeap()
+    for number in range(10):
+        heap.push(f"t{number}", number, number % 3)
+    assert heap.remove('t3') == 3
+    assert 't3' not in heap
+    heap.update('t8', -1)  # 8 % 3 == 2, now first
+    heap.update('t0', 2)  # keeps its original sequence number, so it leads the key-2 tasks
+    assert heap.key_of('t0') == 2
+    order = [heap.pop()[0] for _ in range(len(heap))]
+    assert order == ['t8', 't6', 't9', 't1', 't4', 't7', 't0', 't2', 't5']
+    try:
+        heap.remove('t3')
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("removed an id that is not queued")
+
+def test_indexed_heap_push_many_matches_single_pushes():
+    """A batch push, heapified or pushed one by one, orders like single pushes."""
+    for queued in (0, 20):
+        single, batch = IndexedHeap(), IndexedHeap()
+        for heap in (single, batch):
+            for number in range(queued):
+                heap.push(f"q{number}", number, number % 4)
+        entries = [(f"t{number}", number, number % 5) for number in range(12)]
+        for entry in entries:
+            single.push(*entry)
+        batch.push_many(entries)
+        assert [batch.pop() for _ in range(len(batch))] == [single.pop() for _ in range(len(single))]
+
+    heap = IndexedHeap()
+    heap.push('a', 1, 0)
+    try:
+        heap.push_many([('b', 2, 0), ('a', 3, 0)])
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("push_many accepted a queued id")
+    assert len(heap) == 1 and 'b' not in heap
+
+def test_root_dag_runs_a_task_once_all_dependencies_completed():
+    """A task is only released once its indegree reaches zero."""
+    order = []
+    lock = threading.Lock()
+
+    def step(name):
+        with lock:
+            order.append(name)
+        return name
+
+    queue = root_queue.TaskQueue(max_workers=4)
+    queue.start()
+    try:
+        first = queue.add_task(root_queue.Task('first', step, args=('first',)))
+        second = queue.add_task(root_queue.Task('second', step, args=('second',)))
+        joined = queue.submit(root_queue.Task('joined', step, args=('joined',), dependencies=[first, second]))
+        assert joined.result(5) == 'joined'
+    finally:
+        queue.stop()
+    assert order[-1] == 'joined' and sorted(order[:2]) == ['first', 'second']
+    status = queue.get_task_status(joined.task_id)
+    assert status['dependency_status'] == {first: True, second: True}
+
+def test_root_dag_failure_fails_transitive_dependents():
+    """A failed task fails its dependents, theirs, and later tasks that depend on it."""
+    calls = []
+
+    def broken():
+        raise ValueError("boom")
+
+    queue = root_queue.TaskQueue(max_workers=2)
+    queue.start()
+    try:
+        root_id = queue.add_task(root_queue.Task('root', broken, max_retries=0))
+        child = queue.submit(root_queue.Task('child', calls.append, args=(1,), dependencies=[root_id]))
+        grandchild = queue.submit(root_queue.Task('grandchild', calls.append, args=(2,),
+                                                  dependencies=[child.task_id]))
+        for future in (child, grandchild):
+            try:
+                future.result(5)
+            except Exception:
+                pass
+            else:
+                raise AssertionError("dependent of a failed task completed")
+        late = queue.submit(root_queue.Task('late', calls.append, args=(3,), dependencies=[root_id]))
+        try:
+            late.result(5)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("task added after its dependency failed completed")
+    finally:
+        queue.stop()
+    assert calls == []
+    assert queue.get_task_status(grandchild.task_id)['status'] == 'failed'
+
+def test_journal_recover_requeues_tasks_unfinished_at_shutdown():
+    """recover() re-runs picklable unfinished tasks and abandons the rest."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'journal.db'
+        journal = TaskJournal(path)
+        queue = TaskQueue(max_workers=1, journal=journal)
+        queue.add_task(Task('picklable', abs, args=(-3,)), priority=2)
+        queue.add_task(Task('unpicklable', lambda: 1))
+        journal.flush(5)
+        journal.close()
+
+        journal = TaskJournal(path)
+        queue = TaskQueue(max_workers=1, journal=journal)
+        assert queue.recover() == ['picklable']
+        queue.start()
+        try:
+            assert queue.tasks['picklable'].future.result(5) == 3
+        finally:
+            queue.stop()
+            journal.close()
+
+        journal = TaskJournal(path)
+        try:
+            assert journal.unfinished() == []
+        finally:
+            journal.close()
+
+def test_journal_checkpoints_survive_reopen_and_resume_a_graph():
+    """A rerun after a restart restores completed stages from the journal."""
+    calls = []
+
+    def chat(value):
+        calls.append('chat')
+        return value + 1
+
+    def flaky(value):
+        calls.append('flaky')
+        if calls.count('flaky') == 1:
+            raise ValueError("first run fails")
+        return value * 10
+
+    graph = StageGraph().add('chat', chat).add('flaky', flaky, after=['chat'], max_retries=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'journal.db'
+        for expect_failure in (True, False):
+            journal = TaskJournal(path)
+            queue = TaskQueue(max_workers=1, journal=journal)
+            queue.start()
+            try:
+                future = graph.run(queue, 'run_1', 1)
+                if expect_failure:
+                    try:
+                        future.result(5)
+                    except ValueError:
+                        pass
+                    else:
+                        raise AssertionError("first run did not fail")
+                    assert journal.load_checkpoints('run_1') == {'chat': 2}
+                else:
+                    run = future.result(5)
+                    assert run.outputs == {'chat': 2, 'flaky': 20}
+                    assert run.timings['chat']['checkpointed']
+            finally:
+                queue.stop()
+                journal.close()
+        assert calls == ['chat', 'flaky', 'flaky']
+
+        journal = TaskJournal(path)
+        try:
+            assert journal.load_checkpoints('run_1') == {}
+        finally:
+            journal.close()
+
+def test_root_snapshots_stay_consistent_under_concurrent_writes():
+    """Every published snapshot agrees with its own id indexes."""
+    queue = root_queue.TaskQueue(max_workers=4)
+    queue.start()
+    errors = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            snapshot = queue.snapshot()
+            ids = snapshot.find()
+            if len(ids) != len(snapshot):
+                errors.append(('count', len(ids), len(snapshot)))
+            for status in ('pending', 'running', 'completed'):
+                for task_id in snapshot.find(status):
+                    if snapshot.get(task_id)['status'] != status:
+                        errors.append((task_id, status))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    try:
+        futures = [queue.submit(root_queue.Task(f"t{number % 5}", int)) for number in range(500)]
+        for future in futures:
+            future.result(5)
+    finally:
+        done.set()
+        reader.join()
+        queue.stop()
+    assert errors == []
+    assert len(queue.find_tasks('completed')) == 500
+
+def test_async_queue_retries_then_releases_dependents():
+    """Failed async tasks retry, and dependents run or fail with their dependency."""
+    async def scenario():
+        queue = AsyncTaskQueue()
+        await queue.start()
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ValueError("not yet")
+            return 'ready'
+
+        async def after(value=None):
+            return queue.get_task_status('flaky')['status']
+
+        async def broken():
+            raise ValueError("boom")
+
+        queue.add_task(AsyncTask('flaky', flaky, retry_delay=0.01, max_retries=3))
+        queue.add_task(AsyncTask('after', after, dependencies=['flaky']))
+        queue.add_task(AsyncTask('broken', broken, max_retries=1))
+        queue.add_task(AsyncTask('blocked', after, dependencies=['broken']))
+        await queue.join()
+        await queue.stop()
+        return queue, attempts
+
+    queue, attempts = asyncio.run(scenario())
+    assert len(attempts) == 3
+    assert queue.tasks['flaky'].future.result() == 'ready'
+    assert queue.tasks['after'].future.result() == 'completed'
+    assert queue.get_task_status('broken')['status'] == 'failed'
+    assert queue.get_task_status('blocked')['status'] == 'failed'
+
+def test_graph_rerun_reuses_sibling_stage_still_running():
+    """Rerunning a failed graph waits on the failed run's live stages instead of rejecting them."""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value
+
+    def broken(value):
+        raise ValueError("boom")
+
+    graph = (StageGraph()
+             .add('root', lambda value: value)
+             .add('slow', slow, after=['root'])
+             .add('broken', broken, after=['root'], max_retries=0))
+    queue = TaskQueue(max_workers=4)
+    queue.start()
+    try:
+        first = graph.run(queue, 'iteration_1', 1)
+        assert started.wait(5)
+        try:
+            first.result(5)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("failed stage did not fail the run")
+        second = graph.run(queue, 'iteration_1', 1)
+        assert not second.done()
+        release.set()
+        try:
+            second.result(5)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("failed stage did not fail the rerun")
+        assert calls == [1]
+    finally:
+        release.set()
+        queue.stop()
+
+if __name__ == "__main__":
+    test_resubmit_same_id_and_key_coalesces_while_running()
+    test_resubmit_same_id_without_key_is_rejected_while_running()
+    test_stop_cancels_tasks_waiting_for_retry_or_refill()
+    test_async_stop_cancels_waiting_and_retrying_tasks()
+    test_root_snapshot_indexes_are_consistent_and_immutable()
+    test_indexed_heap_pops_equal_keys_in_fifo_order()
+    test_indexed_heap_remove_and_update_keep_order()
+    test_indexed_heap_push_many_matches_single_pushes()
+    test_root_dag_runs_a_task_once_all_dependencies_completed()
+    test_root_dag_failure_fails_transitive_dependents()
+    test_journal_recover_requeues_tasks_unfinished_at_shutdown()
+    test_journal_checkpoints_survive_reopen_and_resume_a_graph()
+    test_root_snapshots_stay_consistent_under_concurrent_writes()
+    test_async_queue_retries_then_releases_dependents()
+    test_graph_rerun_reuses_sibling_stage_still_running()
+    print("✅ TaskQueue tests passed")
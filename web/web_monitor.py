@@ -16,8 +16,9 @@ from pathlib import Path
 # Add parent directories to path for imports
 sys.path.append(str(Path(__file__).parent.parent))
 
-from core.task_queue import TaskQueue, Task
+from core.task_queue import TaskQueue
 import traceback
+from concurrent.futures import wait
 
 app = Flask(__name__, 
            template_folder='templates',
@@ -118,7 +119,9 @@ def start_automation():
         
         # Initialize task queue if not exists
         if not system_state['task_queue']:
-            system_state['task_queue'] = TaskQueue(max_workers=2)
+            from core.echo_loop import RESOURCE_LIMITS
+            system_state['task_queue'] = TaskQueue(min_workers=1, max_workers=4, max_finished_tasks=500,
+                                                   resources=RESOURCE_LIMITS)
             system_state['task_queue'].start()
         
         system_state['status'] = 'running'
@@ -184,7 +187,7 @@ def resume_automation():
 def automation_loop():
     """Main automation loop running in background."""
     try:
-        from core.echo_loop import process_iteration
+        from core.echo_loop import build_iteration_graph
         from automation.browser_controller import BrowserController
         
         # Initialize browser
@@ -193,6 +196,7 @@ def automation_loop():
             raise Exception("Failed to initialize browser")
         
         iteration = system_state['current_iteration']
+        iteration_graph = build_iteration_graph(browser)
         
         while system_state['status'] in ['running', 'paused']:
             try:
@@ -200,34 +204,28 @@ def automation_loop():
                     time.sleep(1)
                     continue
                 
-                # Create iteration task
-                iteration_task = Task(
-                    f"iteration_{iteration}",
-                    process_iteration,
-                    args=(browser, iteration),
-                    max_retries=3,
-                    retry_delay=5
-                )
+                # Run the iteration's stages on the queue
+                future = iteration_graph.run(system_state['task_queue'], f"iteration_{iteration}",
+                                             iteration, priority=1)
                 
-                # Add task to queue
-                task_id = system_state['task_queue'].add_task(iteration_task, priority=1)
-                
-                # Wait for completion
-                while True:
-                    status = system_state['task_queue'].get_task_status(task_id)
-                    if status['status'] in ['completed', 'failed']:
-                        if status['status'] == 'failed':
-                            error_msg = f"Iteration {iteration} failed: {status['error']}"
-                            logging.error(error_msg)
-                            system_state['errors'].append({
-                                'timestamp': datetime.now().isoformat(),
-                                'message': error_msg
-                            })
-                        else:
-                            system_state['current_iteration'] = iteration
-                            system_state['last_update'] = datetime.now()
+                # Wait for completion, checking periodically whether we were stopped
+                while not wait([future], timeout=1).done:
+                    if system_state['status'] == 'stopped':
                         break
-                    time.sleep(1)
+                if not future.done():
+                    break
+                
+                if future.exception() is not None:
+                    error_msg = f"Iteration {iteration} failed: {future.exception()}"
+                    logging.error(error_msg)
+                    system_state['errors'].append({
+                        'timestamp': datetime.now().isoformat(),
+                        'message': error_msg
+                    })
+                else:
+                    logging.info(f"Completed iteration {iteration}: {future.result().summary()}")
+                    system_state['current_iteration'] = iteration
+                    system_state['last_update'] = datetime.now()
                 
                 iteration += 1
                 time.sleep(2)  # Brief pause between iterations
@@ -38,6 +38,11 @@ automation_state = {
 # Global task queue
 task_queue = None
 
+# Requests sent recently, so a resend of the same request is only delivered once
+SEND_MESSAGE_TTL = 60  # seconds
+recent_messages = {}  # client request id -> (monotonic time sent, response or None while sending)
+recent_messages_lock = threading.Lock()
+
 def update_state(status=None, current_step=None, progress=None, iteration=None, log_message=None, tasks=None,
                 error_count=None, success_count=None, total_iterations=None):
     """Update the global state."""
@@ -135,54 +140,79 @@ def send_message():
         if not message:
             return jsonify({'error': 'Message cannot be empty'}), 400
         
-        # Create timestamp for the message
-        timestamp = datetime.now().isoformat()
-        
-        # Write to user input file that AI agents can read
-        user_input_file = 'user_input.txt'
-        with open(user_input_file, 'w', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] User Command: {message}")
-        
-        # Also write to individual agent input files
-        agent_files = ['ai_1_input.txt', 'ai_2_input.txt', 'ai_3_input.txt']
-        for agent_file in agent_files:
-            try:
-                with open(agent_file, 'w', encoding='utf-8') as f:
-                    f.write(f"[{timestamp}] User Command: {message}")
-            except Exception as e:
-                logging.error(f"Error writing to {agent_file}: {str(e)}")
-        
-        # Log the message
-        update_state(log_message=f"User message sent to all agents: {message}")
+        # Only a resend of the same client request is a duplicate; the same text sent again is not
+        key = request.headers.get('Idempotency-Key') or data.get('request_id')
+        if not key:
+            return jsonify(deliver_message(message))
+        now = time.monotonic()
+        with recent_messages_lock:
+            for expired in [k for k, (sent, _) in recent_messages.items() if now - sent > SEND_MESSAGE_TTL]:
+                del recent_messages[expired]
+            if key in recent_messages:
+                response = recent_messages[key][1] or {'status': 'success', 'message': 'Command is being sent'}
+                return jsonify({**response, 'duplicate': True})
+            recent_messages[key] = (now, None)
         
-        # Clear the AI output files to prepare for new responses
-        output_files = ['ai_1_out.txt', 'ai_2_out.txt', 'ai_3_out.txt']
-        for output_file in output_files:
-            try:
-                if os.path.exists(output_file):
-                    # Keep a backup of the last message
-                    backup_file = f"{output_file}.backup"
-                    with open(output_file, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    with open(backup_file, 'w', encoding='utf-8') as f:
-                        f.write(content)
-                    
-                    # Clear the output file
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        f.write("")
-            except Exception as e:
-                logging.error(f"Error clearing {output_file}: {str(e)}")
-        
-        return jsonify({
-            'status': 'success',
-            'message': 'Command sent to all AI agents',
-            'timestamp': timestamp
-        })
+        try:
+            response = deliver_message(message)
+        except Exception:
+            with recent_messages_lock:
+                recent_messages.pop(key, None)
+            raise
+        with recent_messages_lock:
+            recent_messages[key] = (now, response)
+        return jsonify(response)
         
     except Exception as e:
         logging.error(f"Error sending message: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def deliver_message(message):
+    """Write a user command to the agent input files and clear their outputs."""
+    # Create timestamp for the message
+    timestamp = datetime.now().isoformat()
+    
+    # Write to user input file that AI agents can read
+    user_input_file = 'user_input.txt'
+    with open(user_input_file, 'w', encoding='utf-8') as f:
+        f.write(f"[{timestamp}] User Command: {message}")
+    
+    # Also write to individual agent input files
+    agent_files = ['ai_1_input.txt', 'ai_2_input.txt', 'ai_3_input.txt']
+    for agent_file in agent_files:
+        try:
+            with open(agent_file, 'w', encoding='utf-8') as f:
+                f.write(f"[{timestamp}] User Command: {message}")
+        except Exception as e:
+            logging.error(f"Error writing to {agent_file}: {str(e)}")
+    
+    # Log the message
+    update_state(log_message=f"User message sent to all agents: {message}")
+    
+    # Clear the AI output files to prepare for new responses
+    output_files = ['ai_1_out.txt', 'ai_2_out.txt', 'ai_3_out.txt']
+    for output_file in output_files:
+        try:
+            if os.path.exists(output_file):
+                # Keep a backup of the last message
+                backup_file = f"{output_file}.backup"
+                with open(output_file, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                with open(backup_file, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                
+                # Clear the output file
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    f.write("")
+        except Exception as e:
+            logging.error(f"Error clearing {output_file}: {str(e)}")
+    
+    return {
+        'status': 'success',
+        'message': 'Command sent to all AI agents',
+        'timestamp': timestamp
+    }
+
 @app.route('/api/conversation/<filename>')
 def get_conversation_file(filename):
     """Get content of a specific AI conversation file."""
@@ -216,8 +246,14 @@ def get_state():
     """Get the current automation state."""
     try:
         if task_queue:
-            # Convert tasks dictionary to array of task objects
-            tasks = task_queue.get_all_tasks()
+            # Convert tasks dictionary to array of task objects, optionally
+            # filtered with ?status=failed&prefix=iteration_
+            status_filter = request.args.get('status')
+            prefix_filter = request.args.get('prefix', '')
+            if status_filter or prefix_filter:
+                tasks = task_queue.get_all_tasks(status=status_filter, prefix=prefix_filter)
+            else:
+                tasks = task_queue.get_all_tasks()
             task_list = []
             for task_id, task in tasks.items():
                 task_list.append({